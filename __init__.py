@@ -1,16 +1,39 @@
 import sys
 
 from .openlock import (  # noqa: F401
+    AsyncFileLock,
+    Deadlock,
+    DecorrelatedJitter,
+    ExponentialBackoff,
     FileLock,
+    FileSemaphore,
+    FixedRetry,
     InvalidLockFile,
     InvalidOption,
     InvalidRelease,
+    InvalidTransfer,
+    LockInfo,
+    LockPool,
+    LockServer,
+    LockStats,
+    MultiLock,
     OpenLockException,
+    Reaper,
+    RetryPolicy,
+    SharedFileLock,
     Timeout,
     __version__,
+    acquire_all,
+    disable_metrics,
+    enable_metrics,
     get_defaults,
+    get_metrics,
+    inspect,
     logger,
+    reap,
+    release_all,
     set_defaults,
+    single_flight,
 )
 
 if sys.version_info >= (3, 11):
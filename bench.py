@@ -0,0 +1,527 @@
+"""
+Benchmarks for openlock.
+
+Run ``python bench.py [benchmark ...]`` from a checkout, or
+``python -m openlock.bench [benchmark ...]`` when the checkout is used as
+a package. The results are printed as JSON, so that they can be compared
+across versions.
+
+Benchmarks involving lock files are run in each of the directories given
+by ``--dir`` (by default a directory on tmpfs, if available, and one on
+the file system of the current directory).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    from . import openlock  # type: ignore
+except ImportError:
+    import openlock  # type: ignore
+
+Result = Dict[str, Any]
+
+
+def summary(samples: List[float]) -> Result:
+    samples = sorted(samples)
+    n = len(samples)
+    if n == 0:
+        return {"count": 0}
+    return {
+        "count": n,
+        "mean_us": 1e6 * statistics.mean(samples),
+        "median_us": 1e6 * statistics.median(samples),
+        "p99_us": 1e6 * samples[min(n - 1, int(0.99 * n))],
+        "max_us": 1e6 * samples[-1],
+    }
+
+
+def timed(f: Callable[[], Any], count: int) -> List[float]:
+    samples = []
+    for _ in range(count):
+        t = time.perf_counter()
+        f()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+
+def dead_pid() -> int:
+    p = subprocess.Popen([sys.executable, "-c", "pass"])
+    p.wait()
+    return p.pid
+
+
+def bench_pid_valid(args: argparse.Namespace) -> Result:
+    # The cost of a liveness check, for each backend.
+    pid = os.getpid()
+    name = Path(sys.argv[0]).stem
+    result: Result = {}
+    backends = [("ps", openlock._pid_valid_ps)]
+    if openlock.HAS_PROCFS:
+        backends.append(("proc", openlock._pid_valid_proc))
+    for backend, f in backends:
+        assert f(pid, name)
+        result[backend] = summary(timed(lambda: f(pid, name), args.count))
+    return result
+
+
+def bench_uncontended(args: argparse.Namespace, directory: str) -> Result:
+    # The cost of acquiring and releasing a free lock, for each way of
+    # creating the lock file.
+    lock_file = os.path.join(directory, "uncontended.lock")
+    result: Result = {}
+    methods = ["o_tmpfile", "temp_name"] if openlock._use_tmpfile else ["temp_name"]
+    use_tmpfile = openlock._use_tmpfile
+    try:
+        for method in methods:
+            openlock._use_tmpfile = method == "o_tmpfile"
+            lock = openlock.FileLock(lock_file)
+            acquire: List[float] = []
+            release: List[float] = []
+            for _ in range(args.count):
+                acquire.extend(timed(lock.acquire, 1))
+                release.extend(timed(lock.release, 1))
+            if method == "o_tmpfile" and directory in openlock._no_tmpfile_dirs:
+                # not supported, the fallback was used
+                method = "o_tmpfile_unsupported"
+            result[method] = {
+                "acquire": summary(acquire),
+                "release": summary(release),
+                "throughput": len(acquire) / (sum(acquire) + sum(release)),
+            }
+    finally:
+        openlock._use_tmpfile = use_tmpfile
+    return result
+
+
+def holder(lock_file: str, ready: Any, done: Any) -> None:
+    lock = openlock.FileLock(lock_file)
+    lock.acquire()
+    ready.set()
+    done.wait()
+    lock.release()
+
+
+def bench_status(args: argparse.Namespace, directory: str) -> Result:
+    # The cost of locked() and getpid(), for a free lock, for a lock held
+    # by another process and for a stale lock, with and without a cached
+    # lock state.
+    ctx = multiprocessing.get_context()
+    lock_file = os.path.join(directory, "status.lock")
+    lock = openlock.FileLock(lock_file)
+    cached_lock = openlock.FileLock(lock_file, cache_ttl=60)
+    result: Result = {}
+
+    def measure(state: str) -> None:
+        result[state] = {
+            "locked": summary(timed(lock.locked, args.count)),
+            "getpid": summary(timed(lock.getpid, args.count)),
+            "locked_cached": summary(timed(cached_lock.locked, args.count)),
+            "getpid_cached": summary(timed(cached_lock.getpid, args.count)),
+        }
+
+    measure("free")
+    ready, done = ctx.Event(), ctx.Event()
+    p = ctx.Process(target=holder, args=(lock_file, ready, done))
+    p.start()
+    ready.wait()
+    measure("held")
+    done.set()
+    p.join()
+    with open(lock_file, "w") as f:
+        f.write(f"{dead_pid()}\nbench\n")
+    measure("stale")
+    os.remove(lock_file)
+    return result
+
+
+def handoff_waiter(
+    lock_file: str, options: Dict[str, Any], ready: Any, queue: Any
+) -> None:
+    openlock.set_defaults(**options)
+    # warm up
+    with openlock.FileLock(lock_file + ".warmup"):
+        pass
+    lock = openlock.FileLock(lock_file)
+    ready.set()
+    lock.acquire()
+    queue.put(time.monotonic())
+    lock.release()
+
+
+def bench_handoff(args: argparse.Namespace, directory: str) -> Result:
+    # The time between the release of a lock and its acquisition by a
+    # process which was waiting for it.
+    ctx = multiprocessing.get_context()
+    lock_file = os.path.join(directory, "handoff.lock")
+    defaults = openlock.get_defaults()
+    retry_period = defaults["retry_period"]
+    modes: Dict[str, Dict[str, Any]] = {
+        "poll": {"wait_mode": "poll"},
+        "inotify": {"wait_mode": "inotify"},
+    }
+    server = None
+    if hasattr(socket, "AF_UNIX"):
+        server = openlock.LockServer(os.path.join(directory, "handoff.sock"))
+        modes["server"] = {"server": server.socket_path}
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        while not os.path.exists(server.socket_path):
+            time.sleep(0.01)
+    result: Result = {}
+    try:
+        for mode, options in modes.items():
+            openlock.set_defaults(**options)
+            lock = openlock.FileLock(lock_file)
+            samples = []
+            for _ in range(args.rounds):
+                lock.acquire()
+                ready, queue = ctx.Event(), ctx.Queue()
+                p = ctx.Process(
+                    target=handoff_waiter, args=(lock_file, options, ready, queue)
+                )
+                p.start()
+                ready.wait()
+                # release at a random point of the retry period of the waiter
+                time.sleep(0.1 + random.uniform(0, retry_period))
+                t = time.monotonic()
+                lock.release()
+                samples.append(queue.get() - t)
+                p.join()
+            result[mode] = summary(samples)
+            openlock.set_defaults(**defaults)
+    finally:
+        openlock.set_defaults(**defaults)
+        if server is not None:
+            server.stop()
+            thread.join()
+    return result
+
+
+def contention_thread(
+    lock_file: str,
+    policy: Any,
+    fair: bool,
+    hold: float,
+    start: float,
+    duration: float,
+    waits: List[float],
+) -> None:
+    lock = openlock.FileLock(lock_file, retry_policy=policy, fair=fair)
+    while time.time() < start:
+        time.sleep(0.001)
+    while time.time() < start + duration:
+        t = time.monotonic()
+        lock.acquire()
+        waits.append(time.monotonic() - t)
+        time.sleep(hold)
+        lock.release()
+        # think time
+        time.sleep(hold)
+
+
+def contention_worker(
+    lock_file: str,
+    policy: Any,
+    fair: bool,
+    threads: int,
+    hold: float,
+    start: float,
+    duration: float,
+    queue: Any,
+) -> None:
+    waits: List[float] = []
+    threads_ = [
+        threading.Thread(
+            target=contention_thread,
+            args=(lock_file, policy, fair, hold, start, duration, waits),
+        )
+        for _ in range(threads)
+    ]
+    for thread in threads_:
+        thread.start()
+    for thread in threads_:
+        thread.join()
+    queue.put(waits)
+
+
+def bench_contention(args: argparse.Namespace, directory: str) -> Result:
+    # Acquisitions per second and the distribution of the waiting times
+    # when args.threads threads in each of args.procs processes compete
+    # for a lock, for several retry policies and in fair mode.
+    ctx = multiprocessing.get_context()
+    lock_file = os.path.join(directory, "contention.lock")
+    variants = {
+        "fixed": (openlock.FixedRetry(openlock.get_defaults()["retry_period"]), False),
+        "exponential_backoff": (openlock.ExponentialBackoff(), False),
+        "decorrelated_jitter": (openlock.DecorrelatedJitter(), False),
+        "fair": (openlock.ExponentialBackoff(), True),
+    }
+    result: Result = {}
+    for name, (policy, fair) in variants.items():
+        queue = ctx.Queue()
+        start = time.time() + 0.5
+        processes = [
+            ctx.Process(
+                target=contention_worker,
+                args=(
+                    lock_file,
+                    policy,
+                    fair,
+                    args.threads,
+                    args.hold,
+                    start,
+                    args.duration,
+                    queue,
+                ),
+            )
+            for _ in range(args.procs)
+        ]
+        for p in processes:
+            p.start()
+        waits: List[float] = []
+        for _ in processes:
+            waits.extend(queue.get())
+        for p in processes:
+            p.join()
+        result[name] = {
+            "policy": repr(policy),
+            "fair": fair,
+            "throughput": len(waits) / args.duration,
+            "wait": summary(waits),
+        }
+    return result
+
+
+def bench_stale(args: argparse.Namespace, directory: str) -> Result:
+    # The time needed to acquire a lock whose lock file was left behind by
+    # a dead process, with a static and an adaptive race delay, and after
+    # the lock file has been removed by reap().
+    lock_file = os.path.join(directory, "stale.lock")
+    pid = dead_pid()
+    result: Result = {}
+    defaults = openlock.get_defaults()
+    try:
+        for variant in ("static", "adaptive", "reaped"):
+            openlock.set_defaults(adaptive_race_delay=variant == "adaptive")
+            lock = openlock.FileLock(lock_file)
+            # the adaptive race delay needs some samples
+            for _ in range(10):
+                lock.acquire()
+                lock.release()
+            samples = []
+            for _ in range(args.rounds):
+                with open(lock_file, "w") as f:
+                    f.write(f"{pid}\nbench\n")
+                if variant == "reaped":
+                    openlock.reap(directory, "stale.lock")
+                t = time.perf_counter()
+                lock.acquire()
+                samples.append(time.perf_counter() - t)
+                lock.release()
+            result[variant] = summary(samples)
+    finally:
+        openlock.set_defaults(**defaults)
+    return result
+
+
+def bench_inspect(args: argparse.Namespace, directory: str) -> Result:
+    # The time needed to find the state of args.count lock files, half of
+    # them stale, with inspect() and with FileLock.getpid(), with and
+    # without /proc.
+    lock_dir = os.path.join(directory, "inspect")
+    os.makedirs(lock_dir)
+    pids = [os.getpid(), dead_pid()]
+    for i in range(args.count):
+        with open(os.path.join(lock_dir, f"{i}.lock"), "w") as f:
+            f.write(f"{pids[i % 2]}\n{Path(sys.argv[0]).stem}\n")
+    result: Result = {}
+    has_procfs = openlock.HAS_PROCFS
+    try:
+        for procfs in sorted({has_procfs, False}, reverse=True):
+            openlock.HAS_PROCFS = procfs
+            t = time.perf_counter()
+            openlock.inspect(lock_dir)
+            inspect_time = time.perf_counter() - t
+            t = time.perf_counter()
+            for i in range(args.count):
+                openlock.FileLock(os.path.join(lock_dir, f"{i}.lock")).getpid()
+            getpid_time = time.perf_counter() - t
+            result["proc" if procfs else "ps"] = {
+                "inspect_us": 1e6 * inspect_time,
+                "getpid_us": 1e6 * getpid_time,
+            }
+    finally:
+        openlock.HAS_PROCFS = has_procfs
+        shutil.rmtree(lock_dir)
+    return result
+
+
+def semaphore_holder(path: str, slots: int, held: int, ready: Any, done: Any) -> None:
+    semaphore = openlock.FileSemaphore(path, slots)
+    for _ in range(held):
+        semaphore.acquire()
+    ready.set()
+    done.wait()
+    for _ in range(held):
+        semaphore.release()
+
+
+def bench_semaphore(args: argparse.Namespace, directory: str) -> Result:
+    # The time needed to find the last free slot out of 16, the others
+    # being held by another process, with a FileSemaphore and by probing
+    # the slots one after another with FileLock.acquire(timeout=0).
+    ctx = multiprocessing.get_context()
+    slots = 16
+    path = os.path.join(directory, "semaphore")
+    ready, done = ctx.Event(), ctx.Event()
+    p = ctx.Process(target=semaphore_holder, args=(path, slots, slots - 1, ready, done))
+    p.start()
+    ready.wait()
+    semaphore = openlock.FileSemaphore(path, slots)
+    locks = [
+        openlock.FileLock(os.path.join(path, f"slot-{i}.lock")) for i in range(slots)
+    ]
+
+    def acquire_probing() -> openlock.FileLock:
+        for lock in locks:
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except openlock.Timeout:
+                pass
+        raise openlock.Timeout("No free slot")
+
+    semaphore_samples: List[float] = []
+    probing_samples: List[float] = []
+    try:
+        for _ in range(args.count):
+            semaphore_samples.extend(timed(semaphore.acquire, 1))
+            semaphore.release()
+            t = time.perf_counter()
+            lock = acquire_probing()
+            probing_samples.append(time.perf_counter() - t)
+            lock.release()
+    finally:
+        done.set()
+        p.join()
+        shutil.rmtree(path)
+    return {
+        "semaphore": summary(semaphore_samples),
+        "probing": summary(probing_samples),
+    }
+
+
+BENCHMARKS: Dict[str, Tuple[Callable[..., Result], bool]] = {
+    # name: (function, whether it is run in each directory)
+    "pid_valid": (bench_pid_valid, False),
+    "uncontended": (bench_uncontended, True),
+    "status": (bench_status, True),
+    "handoff": (bench_handoff, True),
+    "contention": (bench_contention, True),
+    "stale": (bench_stale, True),
+    "inspect": (bench_inspect, True),
+    "semaphore": (bench_semaphore, True),
+}
+
+
+def default_dirs() -> List[str]:
+    dirs = []
+    if os.path.isdir("/dev/shm"):
+        dirs.append("/dev/shm")
+    dirs.append(os.getcwd())
+    return dirs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks for openlock.")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)",
+    )
+    parser.add_argument("--count", type=int, default=200, help="number of iterations")
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=20,
+        help="number of rounds for multi-process benchmarks",
+    )
+    parser.add_argument(
+        "--procs", type=int, default=8, help="number of competing processes"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="number of competing threads in each process",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5.0, help="duration of timed benchmarks"
+    )
+    parser.add_argument("--hold", type=float, default=0.001, help="time a lock is held")
+    parser.add_argument(
+        "--dir",
+        action="append",
+        dest="dirs",
+        help="directory in which a temporary directory for the lock files is "
+        "created; may be repeated (default: /dev/shm and the current directory)",
+    )
+    parser.add_argument("--output", help="write the report to this file")
+    args = parser.parse_args()
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: '{name}'")
+    dirs = args.dirs or default_dirs()
+    temp_dirs = [tempfile.mkdtemp(prefix="openlock-bench-", dir=d) for d in dirs]
+    results: Result = {}
+    try:
+        for name in names:
+            f, per_directory = BENCHMARKS[name]
+            if per_directory:
+                results[name] = {
+                    d: f(args, temp_dir) for d, temp_dir in zip(dirs, temp_dirs)
+                }
+            else:
+                results[name] = f(args)
+    finally:
+        for temp_dir in temp_dirs:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    report = {
+        "openlock": openlock.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "options": {
+            k: v for k, v in vars(args).items() if k not in ("benchmarks", "output")
+        },
+        "defaults": {k: repr(v) for k, v in openlock.get_defaults().items()},
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,35 @@
 from __future__ import annotations
 
+import abc
+import argparse
+import asyncio
 import atexit
+import concurrent.futures
 import copy
+import ctypes
+import ctypes.util
+import fnmatch
+import functools
+import hashlib
 import logging
 import os
+import pickle
 import platform
+import random
+import select
+import socket
+import struct
 import subprocess
 import sys
 import tempfile
 import threading
 import time
 import warnings
+import weakref
+import zlib
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Generator, Iterable, TypeVar
 
 if sys.version_info >= (3, 11):
     from typing import TypedDict, Unpack
@@ -22,6 +39,7 @@ __version__ = "1.2.1"
 logger = logging.getLogger(__name__)
 
 IS_WINDOWS = "windows" in platform.system().lower()
+HAS_PROCFS = not IS_WINDOWS and os.path.exists("/proc/self/cmdline")
 
 
 def _pid_valid_windows(pid: int, name: str) -> bool:
@@ -44,9 +62,21 @@ def _pid_valid_windows(pid: int, name: str) -> bool:
     return False
 
 
-def _pid_valid_posix(pid: int, name: str) -> bool:
+def _pid_valid_ps(pid: int, name: str) -> bool:
+    return (pid, name) in _pids_valid_ps([(pid, name)])
+
+
+def _pids_valid_ps(holders: Iterable[tuple[int, str]]) -> set[tuple[int, str]]:
+    # The pairs (pid, name) that belong to a Python process, using a single
+    # ps for all of them.
+    names: dict[int, set[str]] = {}
+    for pid, name in holders:
+        names.setdefault(pid, set()).add(name)
+    valid: set[tuple[int, str]] = set()
+    if len(names) == 0:
+        return valid
     # for busybox these options are undocumented...
-    cmd = ["ps", "-f", str(pid)]
+    cmd = ["ps", "-f"] + [str(pid) for pid in sorted(names)]
 
     with subprocess.Popen(
         cmd,
@@ -70,9 +100,47 @@ def _pid_valid_posix(pid: int, name: str) -> bool:
                 pid_ = int(line_[index])
             except ValueError:
                 continue
-            if name.lower() in line and "python" in line and pid == pid_:
-                return True
-    return False
+            if pid_ not in names or "python" not in line:
+                continue
+            for name in names[pid_]:
+                if name.lower() in line:
+                    valid.add((pid_, name))
+    return valid
+
+
+def _pid_valid_proc(pid: int, name: str) -> bool | None:
+    # Returns None if /proc does not give a definite answer.
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        pass
+    except OSError:
+        return None
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read()
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return None
+    if len(cmdline) == 0:
+        # zombie or kernel thread
+        return False
+    line = cmdline.replace(b"\0", b" ").decode(errors="replace").lower()
+    return name.lower() in line and "python" in line
+
+
+def _pid_valid_posix(pid: int, name: str) -> bool:
+    if HAS_PROCFS:
+        valid = _pid_valid_proc(pid, name)
+        if valid is not None:
+            return valid
+    return _pid_valid_ps(pid, name)
 
 
 def _pid_valid(pid: int, name: str) -> bool:
@@ -82,6 +150,271 @@ def _pid_valid(pid: int, name: str) -> bool:
         return _pid_valid_posix(pid, name)
 
 
+def _read_boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+_boot_id = _read_boot_id() if HAS_PROCFS else ""
+
+
+def _process_starttime(pid: int) -> int | None:
+    # The start time of a process in clock ticks after boot. Together with
+    # the boot id it identifies a process uniquely. Returns None if the
+    # process does not exist (or is a zombie) or if /proc is not available.
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    try:
+        # the process name (field 2) may contain spaces and parentheses
+        start = stat.rindex(b")") + 2
+        fields = stat[start:].split()
+        if fields[0] == b"Z":
+            return None
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+_own_starttime: tuple[int, int | None] = (-1, None)
+
+
+def _get_own_starttime() -> int | None:
+    global _own_starttime
+    pid = os.getpid()
+    # recompute after a fork
+    if _own_starttime[0] != pid:
+        _own_starttime = (pid, _process_starttime(pid) if _boot_id else None)
+    return _own_starttime[1]
+
+
+# (pid, starttime) pairs of dead holders on this boot; a process that has
+# exited does not come back
+_dead_holders: set[tuple[int, int]] = set()
+_dead_holders_max = 1024
+
+
+def _holder_valid(
+    pid: int,
+    name: str,
+    starttime: int | None = None,
+    boot_id: str = "",
+    pid_valid: Callable[[int, str], bool] | None = None,
+) -> bool:
+    if starttime is None or not boot_id or not _boot_id:
+        return (pid_valid or _pid_valid)(pid, name)
+    if boot_id != _boot_id:
+        # the holder belongs to a previous boot
+        return False
+    key = (pid, starttime)
+    if key in _dead_holders:
+        return False
+    if _process_starttime(pid) == starttime:
+        return True
+    if len(_dead_holders) >= _dead_holders_max:
+        _dead_holders.clear()
+    _dead_holders.add(key)
+    return False
+
+
+_IN_MOVED_FROM = 0x40
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_inotify_event = struct.Struct("iIII")
+
+
+class _Inotify:
+    # A process wide inotify instance which reports the removal of files.
+    # Closing an inotify file descriptor is slow (it waits for an RCU grace
+    # period) so the instance and its watches are kept for the lifetime of
+    # the process. Waiting threads take turns reading the events.
+
+    pid: int
+    __libc: Any
+    __fd: int
+    __watches: dict[bytes, int]
+    __refs: dict[tuple[int, bytes], int]
+    __removals: dict[tuple[int, bytes], int]
+    __overflows: int
+    __reading: bool
+    __cond: threading.Condition
+
+    def __init__(self, libc: Any) -> None:
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.pid = os.getpid()
+        self.__libc = libc
+        self.__fd = fd
+        self.__watches = {}
+        # the number of _Watch objects for each file, and the number of
+        # removals seen while it was watched
+        self.__refs = {}
+        self.__removals = {}
+        self.__overflows = 0
+        self.__reading = False
+        self.__cond = threading.Condition()
+
+    def watch(self, path: Path) -> tuple[int, bytes]:
+        directory = os.fsencode(os.path.dirname(path) or ".")
+        with self.__cond:
+            wd = self.__watches.get(directory)
+            if wd is None:
+                wd = self.__libc.inotify_add_watch(
+                    self.__fd, directory, _IN_DELETE | _IN_MOVED_FROM
+                )
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno), os.fsdecode(directory))
+                self.__watches[directory] = wd
+            key = (wd, os.fsencode(path.name))
+            self.__refs[key] = self.__refs.get(key, 0) + 1
+            self.__removals.setdefault(key, 0)
+        return key
+
+    def unwatch(self, key: tuple[int, bytes]) -> None:
+        with self.__cond:
+            refs = self.__refs[key] - 1
+            if refs == 0:
+                del self.__refs[key]
+                del self.__removals[key]
+            else:
+                self.__refs[key] = refs
+
+    def count(self, key: tuple[int, bytes]) -> int:
+        # must be called with the condition held, except initially
+        return self.__removals.get(key, 0) + self.__overflows
+
+    def __read_events(self) -> None:
+        while True:
+            try:
+                buffer = os.read(self.__fd, 4096)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = _inotify_event.unpack_from(buffer, offset)
+                offset += _inotify_event.size
+                end = offset + length
+                name = buffer[offset:end].rstrip(b"\0")
+                offset = end
+                if mask & _IN_Q_OVERFLOW:
+                    self.__overflows += 1
+                elif mask & _IN_IGNORED:
+                    # the directory is gone
+                    for directory, wd_ in list(self.__watches.items()):
+                        if wd_ == wd:
+                            del self.__watches[directory]
+                    self.__overflows += 1
+                else:
+                    # most removals are of temporary files nobody watches
+                    key = (wd, name)
+                    if key in self.__removals:
+                        self.__removals[key] += 1
+
+    def wait(self, key: tuple[int, bytes], count: int, timeout: float) -> int:
+        # Waits at most `timeout` seconds for the removal count of `key`
+        # to differ from `count`. Returns the new count.
+        deadline = time.monotonic() + timeout
+        with self.__cond:
+            while self.count(key) == count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self.__reading:
+                    self.__cond.wait(remaining)
+                    continue
+                self.__reading = True
+                self.__cond.release()
+                try:
+                    readable, _, _ = select.select([self.__fd], [], [], remaining)
+                finally:
+                    self.__cond.acquire()
+                    self.__reading = False
+                if readable:
+                    self.__read_events()
+                self.__cond.notify_all()
+            return self.count(key)
+
+
+_inotify_instance: _Inotify | None = None
+_inotify_lock = threading.Lock()
+_inotify_failed = False
+
+
+def _get_inotify() -> _Inotify | None:
+    global _inotify_instance, _inotify_failed
+    with _inotify_lock:
+        if _inotify_failed or not sys.platform.startswith("linux"):
+            return None
+        inotify = _inotify_instance
+        # the instance of the parent is useless after a fork
+        if inotify is not None and inotify.pid == os.getpid():
+            return inotify
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            _inotify_instance = _Inotify(libc)
+        except (OSError, AttributeError) as e:
+            logger.debug("inotify is not available: %s", e)
+            _inotify_failed = True
+        return _inotify_instance
+
+
+class _Watch:
+    # Reports the removal of a single file.
+
+    __inotify: _Inotify
+    __key: tuple[int, bytes]
+    __count: int
+    __closed: bool
+
+    def __init__(self, inotify: _Inotify, path: Path) -> None:
+        self.__inotify = inotify
+        self.__key = inotify.watch(path)
+        self.__count = inotify.count(self.__key)
+        self.__closed = False
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait at most `timeout` seconds for the file to be removed.
+        """
+        count = self.__inotify.wait(self.__key, self.__count, timeout)
+        removed = count != self.__count
+        self.__count = count
+        return removed
+
+    def close(self) -> None:
+        """
+        Stop watching the file.
+        """
+        if not self.__closed:
+            self.__closed = True
+            self.__inotify.unwatch(self.__key)
+
+
+def _watch(path: Path) -> _Watch | None:
+    inotify = _get_inotify()
+    if inotify is None:
+        return None
+    try:
+        return _Watch(inotify, path)
+    except OSError as e:
+        logger.debug("Unable to watch '%s': %s", path, e)
+        return None
+
+
 class OpenLockException(Exception):
     """
     Base exception raised by the openlock library.
@@ -126,6 +459,131 @@ class InvalidOption(OpenLockException):
     pass
 
 
+class InvalidTransfer(OpenLockException):
+    """
+    Raised when :py:meth:`openlock.FileLock.transfer` is called on a lock
+    we do not own, or when :py:meth:`openlock.FileLock.adopt` is called on
+    a lock that has not been transferred to us.
+    """
+
+    pass
+
+
+class Deadlock(OpenLockException):
+    """
+    Raised by :py:meth:`openlock.FileLock.acquire` in `detect_deadlock`
+    mode when processes wait for each other's locks in a cycle. The
+    message names the cycle.
+    """
+
+    pass
+
+
+class RetryPolicy(abc.ABC):
+    """
+    Base class for retry policies. A retry policy determines how long
+    :py:meth:`openlock.FileLock.acquire` waits before reattempting to
+    acquire a lock held by another process.
+    """
+
+    @abc.abstractmethod
+    def delay(self, attempt: int, previous: float) -> float:
+        """
+        The delay before the next attempt.
+
+        :param attempt: the number of failed attempts so far
+        :param previous: the previous delay (`0` before the first retry)
+        """
+
+    def next_delay(
+        self, attempt: int, previous: float, remaining: float | None
+    ) -> float:
+        """
+        The delay before the next attempt, capped by the time remaining
+        before the deadline.
+
+        :param attempt: the number of failed attempts so far
+        :param previous: the previous delay (`0` before the first retry)
+        :param remaining: the time remaining before the deadline, or `None`
+          if there is no deadline
+        """
+        delay = self.delay(attempt, previous)
+        if remaining is not None:
+            delay = min(delay, max(remaining, 0))
+        return delay
+
+
+class FixedRetry(RetryPolicy):
+    """
+    Retry every `period` seconds. This is the default policy, with
+    `period` equal to the `retry_period` option.
+    """
+
+    period: float
+
+    def __init__(self, period: float) -> None:
+        """
+        :param period: the delay between attempts
+        """
+        self.period = period
+
+    def delay(self, attempt: int, previous: float) -> float:
+        return self.period
+
+    def __repr__(self) -> str:
+        return f"FixedRetry({self.period})"
+
+
+class ExponentialBackoff(RetryPolicy):
+    """
+    Exponential backoff with full jitter: the delay before the n-th retry
+    is drawn uniformly from `[0, min(cap, base * 2**(n-1))]`.
+    """
+
+    base: float
+    cap: float
+
+    def __init__(self, base: float = 0.01, cap: float = 0.3) -> None:
+        """
+        :param base: the maximal delay before the first retry
+        :param cap: the maximal delay
+        """
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int, previous: float) -> float:
+        # avoid overflow for large attempts
+        exponent = min(max(attempt - 1, 0), 64)
+        return random.uniform(0, min(self.cap, self.base * 2**exponent))
+
+    def __repr__(self) -> str:
+        return f"ExponentialBackoff(base={self.base}, cap={self.cap})"
+
+
+class DecorrelatedJitter(RetryPolicy):
+    """
+    Decorrelated jitter: the delay is drawn uniformly from
+    `[base, 3 * previous]` and capped at `cap`.
+    """
+
+    base: float
+    cap: float
+
+    def __init__(self, base: float = 0.01, cap: float = 0.3) -> None:
+        """
+        :param base: the minimal delay
+        :param cap: the maximal delay
+        """
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int, previous: float) -> float:
+        return min(self.cap, random.uniform(self.base, max(self.base, 3 * previous)))
+
+    def __repr__(self) -> str:
+        return f"DecorrelatedJitter(base={self.base}, cap={self.cap})"
+
+
 if sys.version_info >= (3, 11):
 
     class _LockState(TypedDict, total=False):
@@ -133,6 +591,10 @@ if sys.version_info >= (3, 11):
         reason: str
         pid: int
         name: str
+        starttime: int | None
+        boot_id: str
+        host: str
+        expires: float | None
 
     class Defaults(TypedDict, total=False):
         """
@@ -151,14 +613,46 @@ if sys.version_info >= (3, 11):
         """
         delay before reattempting to acquire a lock
         """
+        wait_mode: str
+        """
+        how to wait for a lock held by another process: `"poll"` retries
+        every `retry_period` seconds, `"inotify"` retries as soon as the
+        lock file is removed (Linux only, elsewhere it is the same as
+        `"poll"`)
+        """
+        adaptive_race_delay: bool
+        """
+        derive the race delay from the observed latencies of lock file
+        writes and liveness checks in the directory of the lock file,
+        instead of using `race_delay`
+        """
+        retry_policy: RetryPolicy | None
+        """
+        the :py:class:`openlock.RetryPolicy` used when a lock is held by
+        another process; `None` means :py:class:`openlock.FixedRetry` with
+        period `retry_period`
+        """
+        server: str | None
+        """
+        the path of the Unix domain socket of a lock server (see
+        :py:class:`openlock.LockServer`); if it is reachable, processes
+        waiting for a lock are queued by the server instead of polling the
+        lock file; `None` disables the server
+        """
 
 
 _defaults: Defaults = {
     "race_delay": 0.2,
     "tries": 2,
     "retry_period": 0.3,
+    "wait_mode": "poll",
+    "adaptive_race_delay": False,
+    "retry_policy": None,
+    "server": None,
 }
 
+_wait_modes = ("poll", "inotify")
+
 
 def get_defaults() -> Defaults:
     """
@@ -180,9 +674,473 @@ def set_defaults(**kw: Unpack[Defaults]) -> None:
     for k in kw.keys():
         if k not in dk:
             raise InvalidOption(f"Invalid option: '{k}'")
+    if "wait_mode" in kw and kw["wait_mode"] not in _wait_modes:
+        raise InvalidOption(f"Invalid wait mode: '{kw['wait_mode']}'")
     _defaults.update(kw)
 
 
+class LockStats:
+    """
+    Statistics of lock operations, collected while metrics are enabled
+    (see :py:func:`openlock.enable_metrics`). Times are in seconds.
+    """
+
+    acquisitions: int
+    """
+    number of successful acquisitions
+    """
+    wait_time: float
+    """
+    total time spent waiting for the lock, including timeouts
+    """
+    max_wait_time: float
+    """
+    longest wait for the lock
+    """
+    timeouts: int
+    """
+    number of acquisitions which timed out
+    """
+    retries: int
+    """
+    number of times an acquisition was retried after a delay
+    """
+    releases: int
+    """
+    number of releases
+    """
+    hold_time: float
+    """
+    total time the lock was held
+    """
+    liveness_checks: int
+    """
+    number of checks whether the holder of a lock file is alive
+    """
+    liveness_time: float
+    """
+    total time spent in liveness checks
+    """
+    stale_takeovers: int
+    """
+    number of acquisitions by replacing a stale or invalid lock file
+    """
+    invalid_lock_files: int
+    """
+    number of times :py:exc:`openlock.InvalidLockFile` was raised
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Set all statistics to zero.
+        """
+        self.acquisitions = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.retries = 0
+        self.releases = 0
+        self.hold_time = 0.0
+        self.liveness_checks = 0
+        self.liveness_time = 0.0
+        self.stale_takeovers = 0
+        self.invalid_lock_files = 0
+
+    def as_dict(self) -> dict[str, float]:
+        """
+        The statistics as a dictionary.
+        """
+        return dict(vars(self))
+
+    def _record(self, event: str, value: float) -> None:
+        if event == "acquire":
+            self.acquisitions += 1
+            self.wait_time += value
+            self.max_wait_time = max(self.max_wait_time, value)
+        elif event == "timeout":
+            self.timeouts += 1
+            self.wait_time += value
+            self.max_wait_time = max(self.max_wait_time, value)
+        elif event == "retry":
+            self.retries += 1
+        elif event == "release":
+            self.releases += 1
+            self.hold_time += value
+        elif event == "liveness_check":
+            self.liveness_checks += 1
+            self.liveness_time += value
+        elif event == "stale_takeover":
+            self.stale_takeovers += 1
+        elif event == "invalid_lock_file":
+            self.invalid_lock_files += 1
+
+    def __repr__(self) -> str:
+        return f"LockStats({self.as_dict()})"
+
+
+MetricsHook = Callable[[str, "FileLock", float], None]
+
+_metrics_enabled = False
+_metrics_hook: MetricsHook | None = None
+_metrics = LockStats()
+_metrics_lock = threading.Lock()
+
+
+def enable_metrics(hook: MetricsHook | None = None) -> None:
+    """
+    Start collecting statistics, per lock in
+    :py:attr:`openlock.FileLock.stats` and globally in
+    :py:func:`openlock.get_metrics`. When metrics are disabled (the
+    default) the only cost is a test of a global flag.
+
+    :param hook: an optional callback `hook(event, lock, value)`, called
+      for each event; `event` is one of `"acquire"` and `"timeout"` (value:
+      the waiting time), `"release"` (value: the holding time),
+      `"liveness_check"` (value: its duration), `"retry"`,
+      `"stale_takeover"` and `"invalid_lock_file"` (value: `1`)
+    """
+    global _metrics_enabled, _metrics_hook
+    _metrics_hook = hook
+    _metrics_enabled = True
+
+
+def disable_metrics() -> None:
+    """
+    Stop collecting statistics.
+    """
+    global _metrics_enabled, _metrics_hook
+    _metrics_enabled = False
+    _metrics_hook = None
+
+
+def get_metrics() -> LockStats:
+    """
+    A copy of the statistics of all locks together.
+    """
+    with _metrics_lock:
+        return copy.copy(_metrics)
+
+
+def _record_metric(lock: FileLock, event: str, value: float = 1) -> None:
+    with _metrics_lock:
+        lock.stats._record(event, value)
+        _metrics._record(event, value)
+    hook = _metrics_hook
+    if hook is not None:
+        try:
+            hook(event, lock, value)
+        except Exception as e:
+            logger.exception("Error in metrics hook: %s", e)
+
+
+class _RaceDelays:
+    # The latencies of lock file writes and liveness checks, per
+    # directory. A process which finds an invalid lock file checks it and
+    # then overwrites it. The race delay should comfortably exceed the
+    # time this takes, so that a competing process which does the same
+    # will be noticed.
+
+    samples: int = 64
+    min_samples: int = 8
+    margin: float = 4.0
+    floor: float = 0.01
+
+    __latencies: dict[str, deque[float]]
+    __lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.__latencies = {}
+        self.__lock = threading.Lock()
+
+    def record(self, directory: str, latency: float) -> None:
+        with self.__lock:
+            latencies = self.__latencies.get(directory)
+            if latencies is None:
+                latencies = self.__latencies[directory] = deque(maxlen=self.samples)
+            latencies.append(latency)
+
+    def race_delay(self, directory: str, default: float) -> float:
+        with self.__lock:
+            latencies = self.__latencies.get(directory, ())
+            if len(latencies) < self.min_samples:
+                return default
+            # The maximum rather than a percentile, so that a single slow
+            # write counts immediately; it ages out after `samples` writes.
+            return max(self.floor, self.margin * max(latencies))
+
+
+_race_delays = _RaceDelays()
+
+
+def _own_name() -> str:
+    name = sys.argv[0]
+    name_ = name.split()
+    if len(name_) >= 1:
+        name = Path(name_[0]).stem
+    return name
+
+
+def _write_file(path: Path, data: bytes) -> None:
+    # Readers never see a partially written file.
+    temp_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+    temp_file.write(data)
+    temp_file.close()
+    os.replace(temp_file.name, path)
+
+
+# Set to False to always use the fallback in _create_file (bench.py
+# compares both).
+_use_tmpfile = hasattr(os, "O_TMPFILE") and HAS_PROCFS
+_no_tmpfile_dirs: set[str] = set()
+
+
+def _create_file(path: Path, directory: str, data: bytes, temp_name: str) -> bool:
+    # Atomically create a file with content `data`. Return False if the
+    # file exists. Readers never see a partially written file.
+    #
+    # On Linux an anonymous file is created with O_TMPFILE and linked into
+    # the directory (open, write, linkat, close). Elsewhere, or if the file
+    # system does not support O_TMPFILE, the data is written to `temp_name`
+    # which is linked and removed.
+    if _use_tmpfile and directory not in _no_tmpfile_dirs:
+        try:
+            fd = os.open(directory, os.O_TMPFILE | os.O_WRONLY, 0o600)
+        except OSError:
+            _no_tmpfile_dirs.add(directory)
+        else:
+            try:
+                os.write(fd, data)
+                # Without a dir_fd os.link() calls link(2), which does not
+                # follow the magic symlink in /proc. The source is
+                # absolute, so src_dir_fd only selects linkat(2).
+                os.link(
+                    f"/proc/self/fd/{fd}", path, src_dir_fd=fd, follow_symlinks=True
+                )
+                return True
+            except FileExistsError:
+                return False
+            except OSError:
+                _no_tmpfile_dirs.add(directory)
+            finally:
+                os.close(fd)
+    # Do not write through a file or symlink planted at `temp_name`.
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0)
+    try:
+        fd = os.open(temp_name, flags, 0o600)
+    except FileExistsError:
+        # left behind by a dead process with the same PID
+        os.remove(temp_name)
+        fd = os.open(temp_name, flags, 0o600)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    try:
+        os.link(temp_name, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(temp_name)
+
+
+def _hostname() -> str:
+    return platform.node()
+
+
+def _server_acquire(
+    server: str, lock_file: Path, timeout: float | None
+) -> socket.socket | None:
+    # Wait until the lock server grants the lock. Returns the connection,
+    # which is closed to release the lock on the server, or None if the
+    # server is not available.
+    path = os.fsencode(os.path.realpath(lock_file))
+    if not hasattr(socket, "AF_UNIX") or b"\n" in path:
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if timeout == 0:
+        # the server replies at once
+        command = b"TRY "
+        timeout = None
+    else:
+        command = b"ACQUIRE "
+    try:
+        conn.settimeout(timeout)
+        conn.connect(server)
+        conn.sendall(command + path + b"\n")
+        reply = conn.recv(64)
+    except socket.timeout:
+        conn.close()
+        raise Timeout(f"Unable to acquire '{lock_file}' from '{server}'")
+    except OSError as e:
+        conn.close()
+        logger.debug("Lock server '%s' is not available: %s", server, e)
+        return None
+    if reply == b"BUSY\n":
+        conn.close()
+        raise Timeout(f"Unable to acquire '{lock_file}' from '{server}'")
+    if reply != b"GRANTED\n":
+        conn.close()
+        logger.debug("Unexpected reply from lock server '%s': %r", server, reply)
+        return None
+    return conn
+
+
+def _server_release(conn: socket.socket) -> None:
+    # Unlike close(), shutdown() also works if a forked child holds a copy
+    # of the connection.
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    conn.close()
+
+
+def _lock_file_data(
+    pid: int, name: str, starttime: int | None, expires: float | None = None
+) -> bytes:
+    starttime_ = "" if starttime is None else str(starttime)
+    data = f"{pid}\n{name}\n{starttime_}\n{_boot_id}\n"
+    if expires is not None:
+        data += f"{_hostname()}\n{expires:.6f}\n"
+    return data.encode()
+
+
+def _parse_lock_file(s: list[str]) -> _LockState:
+    # The original two line format (pid and name) is still accepted, so
+    # that locks held by older versions of openlock are respected. The
+    # last two lines are only present for leases.
+    try:
+        pid = int(s[0])
+        name = s[1].strip()
+        starttime = int(s[2]) if len(s) > 2 and s[2].strip() else None
+        expires = float(s[5]) if len(s) > 5 else None
+    except (ValueError, IndexError):
+        return {
+            "state": "unlocked",
+            "reason": "invalid lock file",
+        }
+    boot_id = s[3].strip() if len(s) > 3 else ""
+    host = s[4].strip() if len(s) > 4 else ""
+    return {
+        "state": "locked",
+        "pid": pid,
+        "name": name,
+        "starttime": starttime,
+        "boot_id": boot_id,
+        "host": host,
+        "expires": expires,
+    }
+
+
+def _holder_state_valid(
+    lock_state: _LockState, pid_valid: Callable[[int, str], bool] | None = None
+) -> bool:
+    # pid_valid overrides _pid_valid
+    expires = lock_state.get("expires")
+    if expires is not None:
+        if time.time() > expires:
+            return False
+        if lock_state.get("host") != _hostname():
+            # a live lease on another host
+            return True
+    return _holder_valid(
+        lock_state["pid"],
+        lock_state["name"],
+        lock_state.get("starttime"),
+        lock_state.get("boot_id", ""),
+        pid_valid,
+    )
+
+
+def _holder_states_valid(lock_states: list[_LockState]) -> list[bool]:
+    # _holder_state_valid for many lock states, with at most one ps.
+    pending: set[tuple[int, str]] = set()
+
+    def pid_valid_local(pid: int, name: str) -> bool:
+        if IS_WINDOWS:
+            return _pid_valid_windows(pid, name)
+        if HAS_PROCFS:
+            valid = _pid_valid_proc(pid, name)
+            if valid is not None:
+                return valid
+        # decided below
+        pending.add((pid, name))
+        return False
+
+    result = [_holder_state_valid(s, pid_valid_local) for s in lock_states]
+    if len(pending) == 0:
+        return result
+    valid_ps = _pids_valid_ps(pending)
+
+    def pid_valid_ps(pid: int, name: str) -> bool:
+        return (pid, name) in valid_ps
+
+    for i, lock_state in enumerate(lock_states):
+        if (lock_state["pid"], lock_state["name"]) in pending:
+            result[i] = _holder_state_valid(lock_state, pid_valid_ps)
+    return result
+
+
+class _LocalLock:
+    # The state shared by the FileLock objects on the same lock file in
+    # this process. Only the owner competes for the lock file, the other
+    # objects wait for it to release the lock. If there are waiters then the
+    # owner does not remove the lock file, but leaves it to the next owner.
+    # Fair locks and locks using the lock server do not take part.
+
+    condition: threading.Condition
+    owner: FileLock | None
+    waiters: int
+    inherited: bool
+    lease: bool
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.condition = threading.Condition()
+        self.owner = None
+        self.waiters = 0
+        # whether the lock file has been left to the next owner
+        self.inherited = False
+        # whether that lock file contains a lease
+        self.lease = False
+
+
+_local_locks: weakref.WeakValueDictionary[str, _LocalLock] = (
+    weakref.WeakValueDictionary()
+)
+_local_locks_lock = threading.Lock()
+
+
+def _reset_local_locks() -> None:
+    # In a forked child the owners and waiters of the parent are gone, and
+    # the locks may have been held by threads that do not exist in the
+    # child.
+    global _local_locks_lock
+    _local_locks_lock = threading.Lock()
+    for local_lock in list(_local_locks.values()):
+        local_lock.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_local_locks)
+
+
+def _get_local_lock(lock_file: Path) -> _LocalLock:
+    key = os.path.realpath(lock_file)
+    with _local_locks_lock:
+        local_lock = _local_locks.get(key)
+        if local_lock is None:
+            local_lock = _LocalLock()
+            _local_locks[key] = local_lock
+        return local_lock
+
+
 class FileLock:
     """
     The lock constructor. An :py:class:`openlock.FileLock` object
@@ -197,35 +1155,134 @@ class FileLock:
     """
     The value of the timeout parameter.
     """
+    stats: LockStats
+    """
+    The statistics of this lock, collected while metrics are enabled.
+    """
     __lock: threading.Lock
     __acquired: bool
+    __acquired_at: float
+    __reentrant: bool
+    __owner: int | None
+    __count: int
     __retry_period: float
     __race_delay: float
     __tries: int
+    __wait_mode: str
+    __adaptive_race_delay: bool
+    __directory: str | None
+    __retry_policy: RetryPolicy
+    __lease: float | None
+    __lease_lost: bool
+    __renewer: threading.Thread | None
+    __renewer_stop: threading.Event
+    __server: str | None
+    __server_conn: socket.socket | None
+    __fair: bool
+    __tickets: Path
+    __local_lock: _LocalLock
+    __cache_ttl: float | None
+    __state_cache: tuple[tuple[int, int, int], float, _LockState] | None
+    __detect_deadlock: bool
 
     def __init__(
         self,
         lock_file: str | Path = "openlock.lock",
         timeout: float | None = None,
+        retry_policy: RetryPolicy | None = None,
+        reentrant: bool = False,
+        lease: float | None = None,
+        fair: bool = False,
+        cache_ttl: float | None = None,
+        detect_deadlock: bool = False,
     ) -> None:
         """
         :param lock_file: the underlying file used for locking;
           the calling process should have read/write access
         :param timeout: the default for the corresponding argument of
           :py:meth:`openlock.acquire`
+        :param retry_policy: overrides the `retry_policy` option
+        :param reentrant: if `True` then the thread holding the lock may
+          acquire it again without blocking; the lock is only released
+          when :py:meth:`openlock.FileLock.release` has been called as
+          many times as :py:meth:`openlock.FileLock.acquire`
+        :param lease: if not `None` then the lock is held for a lease of
+          this many seconds, which is renewed by a background thread for
+          as long as the lock is held; other processes consider the lock
+          stale once its lease has expired, and only check the PID of the
+          holder if it runs on the same host; this makes it possible to
+          share a lock directory between hosts (e.g. on NFS), provided
+          that their clocks are synchronized
+        :param fair: if `True` then waiters take a ticket, a file in the
+          directory `lock_file` with suffix `.tickets`, and the lock passes
+          to the tickets in order; tickets of dead processes are skipped;
+          fair and plain locks on the same lock file exclude each other,
+          but plain waiters may overtake fair ones
+        :param cache_ttl: if not `None` then
+          :py:meth:`openlock.FileLock.locked` and
+          :py:meth:`openlock.FileLock.getpid` reuse the state of the lock
+          file for this many seconds, as long as its modification time,
+          inode and size are unchanged; a holder that dies in the meantime
+          is only noticed when the cached state expires
+        :param detect_deadlock: if `True` then a process waiting for the
+          lock advertises this in a file in the directory of `lock_file`
+          with suffix `.<pid>.wait`, and checks whether it is part of a
+          cycle of processes waiting for each other's locks in that
+          directory; the process with the highest PID in the cycle then
+          raises :py:exc:`openlock.Deadlock`; this assumes that a process
+          does not release locks while it waits for one (e.g. it is
+          single-threaded); waiting for a ticket in fair mode or for the
+          lock server is not checked
         """
+        if lease is not None and lease <= 0:
+            raise ValueError("The lease should be positive")
+        if cache_ttl is not None and cache_ttl < 0:
+            raise ValueError("The cache TTL should not be negative")
         self.lock_file = Path(lock_file)
         self.timeout = timeout
+        self.stats = LockStats()
         self.__lock = threading.Lock()
         self.__acquired = False
+        self.__acquired_at = 0.0
+        self.__reentrant = reentrant
+        self.__owner = None
+        self.__count = 0
         self.__retry_period = _defaults["retry_period"]
         self.__race_delay = _defaults["race_delay"]
         self.__tries = _defaults["tries"]
-        logger.debug(f"{self} created")
+        self.__wait_mode = _defaults["wait_mode"]
+        self.__adaptive_race_delay = _defaults["adaptive_race_delay"]
+        self.__directory = None
+        if retry_policy is None:
+            retry_policy = _defaults["retry_policy"]
+        if retry_policy is None:
+            retry_policy = FixedRetry(self.__retry_period)
+        self.__retry_policy = retry_policy
+        self.__lease = lease
+        self.__lease_lost = False
+        self.__renewer = None
+        self.__renewer_stop = threading.Event()
+        self.__server = _defaults["server"]
+        self.__server_conn = None
+        self.__fair = fair
+        self.__tickets = Path(f"{self.lock_file}.tickets")
+        self.__local_lock = _get_local_lock(self.lock_file)
+        self.__cache_ttl = cache_ttl
+        self.__state_cache = None
+        self.__detect_deadlock = detect_deadlock
+        logger.debug("%s created", self)
+
+    def __get_directory(self) -> str:
+        if self.__directory is None:
+            self.__directory = os.path.dirname(os.path.abspath(self.lock_file))
+        return self.__directory
+
+    def __record_latency(self, latency: float) -> None:
+        _race_delays.record(self.__get_directory(), latency)
 
     def __lock_state(self, verify_pid_valid: bool = True) -> _LockState:
         try:
-            with open(self.lock_file) as f:
+            with open(self.lock_file, errors="replace") as f:
                 s = f.readlines()
         except FileNotFoundError:
             return {
@@ -233,49 +1290,133 @@ class FileLock:
                 "reason": "file not found",
             }
         except Exception as e:
-            logger.exception(f"Error accessing '{self.lock_file}': {str(e)}")
+            logger.exception("Error accessing '%s': %s", self.lock_file, e)
             raise
+        lock_state = _parse_lock_file(s)
+        if lock_state["state"] != "locked" or not verify_pid_valid:
+            return lock_state
+        if self.__adaptive_race_delay or _metrics_enabled:
+            t = time.time()
+            valid = _holder_state_valid(lock_state)
+            latency = time.time() - t
+            if self.__adaptive_race_delay:
+                self.__record_latency(latency)
+            if _metrics_enabled:
+                _record_metric(self, "liveness_check", latency)
+        else:
+            valid = _holder_state_valid(lock_state)
+        if not valid:
+            pid, name = lock_state["pid"], lock_state["name"]
+            retry = self.__lock_state(verify_pid_valid=False)
+            if retry["state"] == "locked" and (
+                retry["pid"] != pid
+                or retry["name"] != name
+                or retry.get("starttime") != lock_state.get("starttime")
+                or retry.get("expires") != lock_state.get("expires")
+            ):
+                logger.debug(
+                    "Lock file '%s' has changed from {'pid': %s, 'name': %r} "
+                    "to {'pid': %s, 'name': %r}",
+                    self.lock_file,
+                    pid,
+                    name,
+                    retry["pid"],
+                    retry["name"],
+                )
+                return retry
+            else:
+                lock_state["state"] = "unlocked"
+                lock_state["reason"] = (
+                    "pid not valid"
+                    if lock_state["expires"] is None
+                    else "lease expired"
+                )
+                return lock_state
+
+        return lock_state
+
+    def __cached_lock_state(self, fresh: bool) -> _LockState:
+        if self.__cache_ttl is None or fresh:
+            return self.__lock_state()
         try:
-            pid = int(s[0])
-            name = s[1].strip()
-        except (ValueError, IndexError):
+            st = os.stat(self.lock_file)
+        except FileNotFoundError:
             return {
                 "state": "unlocked",
-                "reason": "invalid lock file",
-            }
-
-        if not verify_pid_valid:
-            return {
-                "state": "locked",
-                "pid": pid,
-                "name": name,
+                "reason": "file not found",
             }
-        else:
-            if not _pid_valid(pid, name):
-                retry = self.__lock_state(verify_pid_valid=False)
-                if retry["state"] == "locked" and (
-                    retry["pid"] != pid or retry["name"] != name
-                ):
-                    logger.debug(
-                        f"Lock file '{self.lock_file}' has changed "
-                        f"from {{'pid': {pid}, 'name': '{name}'}} to {{'pid': "
-                        f"{retry['pid']}, 'name': {repr(retry['name'])}}} "
-                    )
-                    return retry
-                else:
-                    return {
-                        "state": "unlocked",
-                        "reason": "pid not valid",
-                        "pid": pid,
-                        "name": name,
-                    }
-
-        return {"state": "locked", "pid": pid, "name": name}
+        # If the lock file changes after the stat, then the next call sees
+        # a different signature.
+        signature = (st.st_mtime_ns, st.st_ino, st.st_size)
+        now = time.monotonic()
+        cache = self.__state_cache
+        if (
+            cache is not None
+            and cache[0] == signature
+            and now - cache[1] < self.__cache_ttl
+        ):
+            return cache[2]
+        lock_state = self.__lock_state()
+        self.__state_cache = (signature, now, lock_state)
+        return lock_state
+
+    def __find_deadlock(self) -> list[tuple[int, str]] | None:
+        # The cycle in the wait-for graph of the lock directory through
+        # this process, if any, as a list of (pid, name of the lock file
+        # waited for), starting with us.
+        directory = self.__get_directory()
+        waits = []
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(".wait"):
+                continue
+            lock_name, _, pid_ = entry.name[: -len(".wait")].rpartition(".")
+            try:
+                with open(entry.path, errors="replace") as f:
+                    lock_state = _parse_lock_file(f.readlines())
+            except FileNotFoundError:
+                continue
+            if lock_state["state"] == "locked" and str(lock_state["pid"]) == pid_:
+                waits.append((entry.path, lock_name, lock_state))
+        valid = _holder_states_valid([lock_state for _, _, lock_state in waits])
+        wait_for = {}
+        for (path, lock_name, lock_state), valid_ in zip(waits, valid):
+            if valid_:
+                wait_for[lock_state["pid"]] = lock_name
+            else:
+                logger.debug("Removing wait file '%s': %s", path, lock_state)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        own_pid = os.getpid()
+        pid = own_pid
+        cycle: list[tuple[int, str]] = []
+        while True:
+            waited_for = wait_for.get(pid)
+            if waited_for is None:
+                return None
+            cycle.append((pid, waited_for))
+            try:
+                with open(os.path.join(directory, waited_for), errors="replace") as f:
+                    lock_state = _parse_lock_file(f.readlines())
+            except FileNotFoundError:
+                return None
+            if lock_state["state"] != "locked":
+                return None
+            pid = lock_state["pid"]
+            if pid == own_pid:
+                return cycle
+            if pid in (pid_ for pid_, _ in cycle):
+                # a cycle without us
+                return None
 
     def __remove_lock_file(self) -> None:
+        if self.__lease_lost:
+            # the lock file belongs to someone else
+            return
         try:
             os.remove(self.lock_file)
-            logger.debug(f"Lock file '{self.lock_file}' removed")
+            logger.debug("Lock file '%s' removed", self.lock_file)
         except OSError:
             pass
 
@@ -283,50 +1424,193 @@ class FileLock:
         if self.lock_file.exists():
             return False
 
-        temp_file = tempfile.NamedTemporaryFile(
-            dir=os.path.dirname(self.lock_file), delete=False
-        )
-        temp_file.write(f"{pid}\n{name}\n".encode())
-        temp_file.close()
-
-        locked = True
-        # try linking, which is atomic, and will fail if the file exists
+        t = time.time()
+        data = _lock_file_data(pid, name, _get_own_starttime(), self.__expires())
+        # A fixed name suffices for the fallback, since attempts on the
+        # same FileLock are serialized.
+        temp_name = f"{self.lock_file}.{pid}.{id(self):x}.tmp"
         try:
-            os.link(temp_file.name, self.lock_file)
-            logger.debug(f"Lock file '{self.lock_file}' created")
-        except FileExistsError:
-            locked = False
+            locked = _create_file(
+                self.lock_file, self.__get_directory(), data, temp_name
+            )
         except OSError as e:
-            logger.error(f"Error creating '{self.lock_file}': {str(e)}")
-            locked = False
-
-        # Remove the temporary file
-        os.remove(temp_file.name)
-
+            logger.error("Error creating '%s': %s", self.lock_file, e)
+            return False
+        if self.__adaptive_race_delay:
+            self.__record_latency(time.time() - t)
+        if locked:
+            logger.debug("Lock file '%s' created", self.lock_file)
         return locked
 
     def __write_lock_file(self, pid: int, name: str) -> None:
-        temp_file = tempfile.NamedTemporaryFile(
-            dir=os.path.dirname(self.lock_file), delete=False
-        )
-        temp_file.write(f"{pid}\n{name}\n".encode())
-        temp_file.close()
-        os.replace(temp_file.name, self.lock_file)
+        data = _lock_file_data(pid, name, _get_own_starttime(), self.__expires())
+        _write_file(self.lock_file, data)
+
+    def __expires(self) -> float | None:
+        if self.__lease is None:
+            return None
+        return time.time() + self.__lease
+
+    def __is_own(self, lock_state: _LockState) -> bool:
+        # PIDs are only meaningful on the same host and boot, and the start
+        # time tells a reused PID apart. Fields that are not recorded on
+        # both sides are not compared.
+        if lock_state["pid"] != os.getpid():
+            return False
+        host = lock_state.get("host")
+        if host and host != _hostname():
+            return False
+        boot_id = lock_state.get("boot_id")
+        if boot_id and _boot_id and boot_id != _boot_id:
+            return False
+        starttime = lock_state.get("starttime")
+        own_starttime = _get_own_starttime()
+        return starttime is None or own_starttime is None or starttime == own_starttime
+
+    def __renew_lease(self) -> None:
+        assert self.__lease is not None
+        while not self.__renewer_stop.wait(self.__lease / 3):
+            with self.__lock:
+                if self.__renewer_stop.is_set():
+                    return
+                try:
+                    lock_state = self.__lock_state(verify_pid_valid=False)
+                    if lock_state["state"] != "locked" or not self.__is_own(lock_state):
+                        logger.error("%s: the lease has been lost", self)
+                        self.__lease_lost = True
+                        return
+                    self.__write_lock_file(os.getpid(), _own_name())
+                    logger.debug("%s: lease renewed", self)
+                except OSError as e:
+                    # e.g. a network file system which is temporarily
+                    # unavailable; try again later
+                    logger.error("%s: unable to renew the lease: %s", self, e)
+
+    def __tickets_list(self) -> list[str]:
+        try:
+            names = os.listdir(self.__tickets)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if name.endswith(".ticket"))
+
+    def __take_ticket(self) -> Path:
+        # The name of a ticket is a sequence number which is one larger
+        # than that of the last ticket.
+        os.makedirs(self.__tickets, exist_ok=True)
+        pid = os.getpid()
+        data = _lock_file_data(pid, _own_name(), _get_own_starttime())
+        temp_name = str(self.__tickets / f"{pid}-{threading.get_ident():x}.tmp")
+        while True:
+            tickets = self.__tickets_list()
+            number = int(tickets[-1].split(".")[0]) + 1 if tickets else 1
+            ticket = self.__tickets / f"{number:012d}.ticket"
+            if _create_file(ticket, str(self.__tickets), data, temp_name):
+                logger.debug("%s: ticket '%s' taken", self, ticket)
+                return ticket
+
+    def __ticket_valid(self, ticket: Path) -> bool:
+        try:
+            with open(ticket, errors="replace") as f:
+                lock_state = _parse_lock_file(f.readlines())
+        except FileNotFoundError:
+            return True
+        return lock_state["state"] == "locked" and _holder_state_valid(lock_state)
+
+    def __wait_for_turn(
+        self, ticket: Path, timeout: float | None, start_time: float
+    ) -> None:
+        # Wait until the tickets before ours are gone. We only look at the
+        # previous ticket, the process owning it looks at the one before.
+        watch, watched = None, None
+        delay = 0.0
+        try:
+            while True:
+                tickets = self.__tickets_list()
+                if ticket.name not in tickets or tickets[0] == ticket.name:
+                    return
+                previous = self.__tickets / tickets[tickets.index(ticket.name) - 1]
+                if not self.__ticket_valid(previous):
+                    logger.debug("%s: removing ticket '%s'", self, previous)
+                    try:
+                        os.remove(previous)
+                    except OSError:
+                        pass
+                    continue
+                if watched != previous:
+                    if watch is not None:
+                        watch.close()
+                    watch, watched = None, previous
+                    if self.__wait_mode == "inotify" and timeout != 0:
+                        # Look again at once, as the ticket may have been
+                        # removed before we started watching it.
+                        watch = _watch(previous)
+                        if watch is not None:
+                            continue
+                now = time.time()
+                remaining = None
+                if timeout is not None:
+                    remaining = start_time + timeout - now
+                    if remaining <= 0:
+                        if _metrics_enabled:
+                            _record_metric(self, "timeout", now - start_time)
+                        raise Timeout(f"Unable to acquire {self}")
+                if _metrics_enabled:
+                    _record_metric(self, "retry")
+                # There is no point in backing off, since waiters do not
+                # compete with each other, and a waiter that oversleeps its
+                # turn delays all the others.
+                delay = self.__retry_policy.next_delay(1, delay, remaining)
+                if watch is not None:
+                    watch.wait(delay)
+                else:
+                    time.sleep(delay)
+        finally:
+            if watch is not None:
+                watch.close()
+
+    @property
+    def lease_lost(self) -> bool:
+        """
+        True if the lock is held with a lease that could not be renewed in
+        time, so that another process may have acquired the lock.
+        """
+        return self.__lease_lost
+
+    @property
+    def _owned(self) -> bool:
+        return self.__acquired
+
+    @property
+    def _retry_policy(self) -> RetryPolicy:
+        return self.__retry_policy
+
+    def __set_acquired(self) -> None:
+        logger.debug("%s acquired", self)
+        self.__acquired = True
+        self.__acquired_at = time.time()
+        atexit.register(self.__remove_lock_file)
+        if self.__lease is not None:
+            self.__lease_lost = False
+            self.__renewer_stop.clear()
+            self.__renewer = threading.Thread(target=self.__renew_lease, daemon=True)
+            self.__renewer.start()
 
     def __acquire_once(self) -> None:
-        pid, name = os.getpid(), sys.argv[0]
-        name_ = name.split()
-        if len(name_) >= 1:
-            name = Path(name_[0]).stem
+        for delay in self._acquire_steps():
+            time.sleep(delay)
+
+    def _acquire_steps(self) -> Generator[float, None, None]:
+        # A single attempt at acquiring the lock. The caller is responsible
+        # for sleeping the delays that are yielded, which allows this to
+        # be shared with AsyncFileLock.
+        pid, name = os.getpid(), _own_name()
 
         if self.__create_lock_file(pid, name):
-            logger.debug(f"{self} acquired")
-            self.__acquired = True
-            atexit.register(self.__remove_lock_file)
+            self.__set_acquired()
             return
 
         lock_state = self.__lock_state()
-        logger.debug(f"{self}: {lock_state}")
+        logger.debug("%s: %s", self, lock_state)
         for _ in range(0, self.__tries):
             if lock_state["state"] == "locked":
                 return
@@ -334,25 +1618,38 @@ class FileLock:
             self.__write_lock_file(pid, name)
             tt = time.time()
             logger.debug(
-                f"Lock file '{self.lock_file}' with contents {{'pid': {pid}, "
-                f"'name': '{name}'}} written in {tt-t:#.2g} seconds"
+                "Lock file '%s' with contents {'pid': %s, 'name': %r} "
+                "written in %#.2g seconds",
+                self.lock_file,
+                pid,
+                name,
+                tt - t,
             )
-            if tt - t >= (2 / 3) * self.__race_delay:
+            race_delay = self.__race_delay
+            if self.__adaptive_race_delay:
+                self.__record_latency(tt - t)
+                race_delay = _race_delays.race_delay(
+                    self.__get_directory(), self.__race_delay
+                )
+                logger.debug("Race delay for %s: %#.2g seconds", self, race_delay)
+            elif tt - t >= (2 / 3) * race_delay:
                 message = (
                     "Slow system detected!! Consider increasing the "
                     "'race_delay' parameter "
-                    f"(current value: {self.__race_delay:#.2g}, used: {tt-t:#.2g})."
+                    f"(current value: {race_delay:#.2g}, used: {tt-t:#.2g})."
                 )
                 warnings.warn(message)
-            time.sleep(self.__race_delay)
+            yield race_delay
             lock_state = self.__lock_state(verify_pid_valid=False)
-            logger.debug(f"{self}: {lock_state}")
+            logger.debug("%s: %s", self, lock_state)
             if lock_state["state"] == "locked":
-                if lock_state["pid"] == os.getpid():
-                    logger.debug(f"{self} acquired")
-                    self.__acquired = True
-                    atexit.register(self.__remove_lock_file)
+                if self.__is_own(lock_state):
+                    self.__set_acquired()
+                    if _metrics_enabled:
+                        _record_metric(self, "stale_takeover")
                 return
+        if _metrics_enabled:
+            _record_metric(self, "invalid_lock_file")
         raise InvalidLockFile("Unable to obtain a valid lock file")
 
     def acquire(self, timeout: float | None = None) -> None:
@@ -366,53 +1663,315 @@ class FileLock:
           the lock has expired
         :raises InvalidLockFile: raised when openlock is unable to create a
           valid lock file
+        :raises Deadlock: raised in `detect_deadlock` mode when waiting
+          for the lock would deadlock
         """
+        if self.__reentrant and self.__owner == threading.get_ident():
+            # Only the owning thread changes the owner, so no locking is
+            # needed.
+            self.__count += 1
+            return
         if timeout is None:
             timeout = self.timeout
         start_time = time.time()
+        if self.__fair or self.__server is not None:
+            # Waiters are served in order by the tickets or by the lock
+            # server, also within this process, so the lock file is never
+            # handed over in memory.
+            self.__acquire_file(timeout, start_time)
+            if _metrics_enabled:
+                _record_metric(self, "acquire", time.time() - start_time)
+            return
+        # First wait for the other FileLock objects on the same lock file
+        # in this process.
+        local_lock = self.__local_lock
+        with local_lock.condition:
+            local_lock.waiters += 1
+            try:
+                while local_lock.owner is not None:
+                    remaining = None
+                    if timeout is not None:
+                        remaining = start_time + timeout - time.time()
+                        if remaining <= 0:
+                            if _metrics_enabled:
+                                wait_time = time.time() - start_time
+                                _record_metric(self, "timeout", wait_time)
+                            raise Timeout(f"Unable to acquire {self}")
+                    local_lock.condition.wait(remaining)
+            finally:
+                local_lock.waiters -= 1
+            local_lock.owner = self
+            inherited, local_lock.inherited = local_lock.inherited, False
+        try:
+            if inherited:
+                self.__inherit()
+            else:
+                self.__acquire_file(timeout, start_time)
+        except BaseException:
+            with local_lock.condition:
+                local_lock.owner = None
+                local_lock.condition.notify()
+            raise
+        if _metrics_enabled:
+            _record_metric(self, "acquire", time.time() - start_time)
+
+    def __inherit(self) -> None:
+        # The previous owner in this process has left us the lock file.
         with self.__lock:
+            if self.__local_lock.lease or self.__lease is not None:
+                self.__write_lock_file(os.getpid(), _own_name())
+            self.__set_acquired()
+            self.__owner = threading.get_ident()
+            self.__count = 1
+
+    def __acquire_file(self, timeout: float | None, start_time: float) -> None:
+        conn = None
+        if self.__server is not None:
+            # Other clients of the server wait on the server, so the lock
+            # file is normally free once the lock is granted. It is still
+            # used to exclude processes that do not use the server.
+            try:
+                conn = _server_acquire(self.__server, self.lock_file, timeout)
+            except Timeout:
+                if _metrics_enabled:
+                    _record_metric(self, "timeout", time.time() - start_time)
+                raise Timeout(f"Unable to acquire {self}") from None
+        ticket = None
+        watch = None
+        wait_file = None
+        try:
+            if self.__fair and conn is None:
+                # Clients of the lock server are already served in order.
+                ticket = self.__take_ticket()
+                self.__wait_for_turn(ticket, timeout, start_time)
+            cycle = None
+            attempt, delay = 0, 0.0
             while True:
-                if not self.__acquired:
-                    self.__acquire_once()
-                    if self.__acquired:
-                        break
+                # The lock is not held while waiting, so that another thread
+                # may release it.
+                with self.__lock:
+                    if not self.__acquired:
+                        self.__acquire_once()
+                        if self.__acquired:
+                            self.__owner = threading.get_ident()
+                            self.__count = 1
+                            self.__server_conn, conn = conn, None
+                            return
+                if watch is None and self.__wait_mode == "inotify" and timeout != 0:
+                    # Retry at once, as the lock file may have been
+                    # removed before we started watching it.
+                    watch = _watch(self.lock_file)
+                    if watch is not None:
+                        continue
                 now = time.time()
-                if timeout is not None and now - start_time >= timeout:
-                    raise Timeout(f"Unable to acquire {self}")
-                time.sleep(self.__retry_period)
-
+                remaining = None
+                if timeout is not None:
+                    remaining = start_time + timeout - now
+                    if remaining <= 0:
+                        if _metrics_enabled:
+                            _record_metric(self, "timeout", now - start_time)
+                        raise Timeout(f"Unable to acquire {self}")
+                if self.__detect_deadlock:
+                    if wait_file is None:
+                        pid = os.getpid()
+                        wait_file = Path(f"{self.lock_file}.{pid}.wait")
+                        data = _lock_file_data(pid, _own_name(), _get_own_starttime())
+                        _write_file(wait_file, data)
+                    else:
+                        # A cycle is only reported if it is seen twice in a
+                        # row, since the wait-for graph is not read
+                        # atomically.
+                        cycle_, cycle = cycle, self.__find_deadlock()
+                        if cycle is not None and cycle == cycle_:
+                            self.__deadlock(cycle)
+                attempt += 1
+                if _metrics_enabled:
+                    _record_metric(self, "retry")
+                delay = self.__retry_policy.next_delay(attempt, delay, remaining)
+                if watch is not None:
+                    watch.wait(delay)
+                else:
+                    time.sleep(delay)
+        finally:
+            if watch is not None:
+                watch.close()
+            if wait_file is not None:
+                try:
+                    os.remove(wait_file)
+                except OSError:
+                    pass
+            if conn is not None:
+                _server_release(conn)
+            if ticket is not None:
+                # the next ticket may compete for the lock file
+                try:
+                    os.remove(ticket)
+                except OSError:
+                    pass
+
+    def __deadlock(self, cycle: list[tuple[int, str]]) -> None:
+        # Only the process with the highest PID in the cycle gives up, so
+        # that the others may proceed.
+        if max(pid for pid, _ in cycle) != os.getpid():
+            return
+        holders = [pid for pid, _ in cycle[1:]] + [cycle[0][0]]
+        description = "; ".join(
+            f"PID {pid} waits for '{lock_name}' held by PID {holder}"
+            for (pid, lock_name), holder in zip(cycle, holders)
+        )
+        logger.debug("%s: deadlock: %s", self, description)
+        raise Deadlock(f"Deadlock while acquiring {self}: {description}")
+
     def release(self) -> None:
         """
         Releases the lock.
 
-        :raises InvalidRelease: raised when we don't own the lock
+        :raises InvalidRelease: raised when we don't own the lock, or,
+          for a reentrant lock, when the calling thread does not hold it
         """
+        if self.__reentrant:
+            if self.__owner != threading.get_ident():
+                raise InvalidRelease(
+                    f"Attempt at releasing {self} which this thread does not own"
+                )
+            if self.__count > 1:
+                self.__count -= 1
+                return
         with self.__lock:
             if not self.__acquired:
                 raise InvalidRelease(f"Attempt at releasing {self} which we do not own")
-            self.__acquired = False
-            self.__remove_lock_file()
-            atexit.unregister(self.__remove_lock_file)
-            logger.debug(f"{self} released")
+            renewer = self.__give_up(transferred=False)
+            logger.debug("%s released", self)
+        if renewer is not None:
+            renewer.join()
+
+    def __give_up(self, transferred: bool) -> threading.Thread | None:
+        # Called with self.__lock held. Returns the lease renewal thread,
+        # which should be joined after self.__lock is released.
+        self.__acquired = False
+        self.__owner = None
+        self.__count = 0
+        self.__renewer_stop.set()
+        renewer, self.__renewer = self.__renewer, None
+        local_lock = self.__local_lock
+        with local_lock.condition:
+            if transferred:
+                # the lock file belongs to the new holder
+                pass
+            elif (
+                local_lock.owner is self
+                and local_lock.waiters > 0
+                and not self.__lease_lost
+            ):
+                # leave the lock file to the next owner in this process
+                local_lock.inherited = True
+                local_lock.lease = self.__lease is not None
+                logger.debug("%s handed over in process", self)
+            else:
+                self.__remove_lock_file()
+            if local_lock.owner is self:
+                local_lock.owner = None
+                local_lock.condition.notify()
+        if self.__server_conn is not None:
+            # hand the lock to the next client of the server
+            _server_release(self.__server_conn)
+            self.__server_conn = None
+        atexit.unregister(self.__remove_lock_file)
+        if _metrics_enabled:
+            _record_metric(self, "release", time.time() - self.__acquired_at)
+        return renewer
+
+    def transfer(self, pid: int, name: str | None = None) -> None:
+        """
+        Transfers the lock to another process, which should then call
+        :py:meth:`openlock.FileLock.adopt`. The lock file is atomically
+        rewritten for the new holder, so the lock is never free in
+        between. Afterwards we no longer hold the lock.
+
+        :param pid: the PID of the new holder
+        :param name: the name of the new holder, i.e. the stem of its
+          `argv[0]`; by default our own, which is correct for a process
+          started by :py:mod:`multiprocessing`
+
+        :raises InvalidTransfer: raised when we don't own the lock, or,
+          for a reentrant lock, when the calling thread does not hold it,
+          or when there is no process with PID `pid`
+        """
+        if self.__reentrant and self.__owner != threading.get_ident():
+            raise InvalidTransfer(
+                f"Attempt at transferring {self} which this thread does not own"
+            )
+        with self.__lock:
+            if not self.__acquired or self.__lease_lost:
+                raise InvalidTransfer(
+                    f"Attempt at transferring {self} which we do not own"
+                )
+            starttime = None
+            if _boot_id:
+                starttime = _process_starttime(pid)
+                if starttime is None:
+                    raise InvalidTransfer(f"There is no process with PID {pid}")
+            if name is None:
+                name = _own_name()
+            _write_file(
+                self.lock_file, _lock_file_data(pid, name, starttime, self.__expires())
+            )
+            renewer = self.__give_up(transferred=True)
+            logger.debug("%s transferred to PID %s", self, pid)
+        if renewer is not None:
+            renewer.join()
 
-    def locked(self) -> bool:
+    def adopt(self) -> None:
+        """
+        Takes over a lock that has been transferred to this process with
+        :py:meth:`openlock.FileLock.transfer`. Afterwards we hold the lock
+        as if we had acquired it.
+
+        :raises InvalidTransfer: raised when the lock has not been
+          transferred to this process, or when it is already held by an
+          object in this process
+        """
+        local_lock = self.__local_lock
+        with self.__lock:
+            lock_state = self.__lock_state(verify_pid_valid=False)
+            if lock_state["state"] != "locked" or not self.__is_own(lock_state):
+                raise InvalidTransfer(f"{self} has not been transferred to us")
+            with local_lock.condition:
+                if local_lock.owner is not None:
+                    raise InvalidTransfer(f"{self} is already held in this process")
+                local_lock.owner = self
+            if lock_state.get("expires") is not None or self.__lease is not None:
+                # start or stop renewing the lease
+                self.__write_lock_file(os.getpid(), _own_name())
+            self.__set_acquired()
+            self.__owner = threading.get_ident()
+            self.__count = 1
+            logger.debug("%s adopted", self)
+
+    def locked(self, fresh: bool = False) -> bool:
         """
         True if we hold the lock.
+
+        :param fresh: if `True` then the cached state of the lock file (see
+          the `cache_ttl` parameter) is not used
         """
         with self.__lock:
             if self.__acquired:
                 return True
-            lock_state = self.__lock_state()
+            lock_state = self.__cached_lock_state(fresh)
             return lock_state["state"] == "locked"
 
-    def getpid(self) -> int | None:
+    def getpid(self, fresh: bool = False) -> int | None:
         """
         The PID of the process that holds the lock, if any. Otherwise returns `None`.
+
+        :param fresh: if `True` then the cached state of the lock file (see
+          the `cache_ttl` parameter) is not used
         """
         with self.__lock:
             if self.__acquired:
                 return os.getpid()
-            lock_state = self.__lock_state()
+            lock_state = self.__cached_lock_state(fresh)
             if lock_state["state"] == "locked":
                 return lock_state["pid"]
             else:
@@ -429,3 +1988,1312 @@ class FileLock:
         return f"FileLock('{self.lock_file}')"
 
     __repr__ = __str__
+
+
+def _next_step(steps: Generator[float, None, None]) -> float | None:
+    return next(steps, None)
+
+
+class AsyncFileLock:
+    """
+    An asyncio variant of :py:class:`openlock.FileLock`. It uses the same
+    lock file protocol, so it interoperates with
+    :py:class:`openlock.FileLock`. An :py:class:`openlock.AsyncFileLock`
+    object supports the asynchronous context manager protocol.
+
+    The `wait_mode` option is ignored: waiting is done with
+    :py:func:`asyncio.sleep` following the retry policy.
+    """
+
+    lock_file: Path
+    """
+    The `Path` object representing the lock file.
+    """
+    timeout: float | None
+    """
+    The value of the timeout parameter.
+    """
+    __file_lock: FileLock
+    __lock: asyncio.Lock | None
+
+    def __init__(
+        self,
+        lock_file: str | Path = "openlock.lock",
+        timeout: float | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        :param lock_file: the underlying file used for locking;
+          the calling process should have read/write access
+        :param timeout: the default for the corresponding argument of
+          :py:meth:`openlock.AsyncFileLock.acquire`
+        :param retry_policy: overrides the `retry_policy` option
+        """
+        self.__file_lock = FileLock(lock_file, timeout, retry_policy=retry_policy)
+        self.lock_file = self.__file_lock.lock_file
+        self.timeout = timeout
+        self.__lock = None
+
+    @property
+    def stats(self) -> LockStats:
+        """
+        The statistics of this lock, collected while metrics are enabled.
+        """
+        return self.__file_lock.stats
+
+    async def __acquire_once(self) -> None:
+        steps = self.__file_lock._acquire_steps()
+        if HAS_PROCFS:
+            # the liveness check does not block
+            for delay in steps:
+                await asyncio.sleep(delay)
+            return
+        # Checking liveness requires a subprocess, so each step is run in
+        # an executor.
+        loop = asyncio.get_running_loop()
+        while True:
+            step = await loop.run_in_executor(None, _next_step, steps)
+            if step is None:
+                return
+            await asyncio.sleep(step)
+
+    async def acquire(self, timeout: float | None = None) -> None:
+        """
+        Attempts to acquires the lock.
+
+        :param timeout: specifies the maximum waiting time in seconds
+          before a :py:exc:`Timeout` exception is raised
+
+        :raises Timeout: raised when the waiting time for acquiring
+          the lock has expired
+        :raises InvalidLockFile: raised when openlock is unable to create a
+          valid lock file
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start_time = time.time()
+        attempt, delay = 0, 0.0
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        async with self.__lock:
+            while True:
+                if not self.__file_lock._owned:
+                    await self.__acquire_once()
+                    if self.__file_lock._owned:
+                        if _metrics_enabled:
+                            wait_time = time.time() - start_time
+                            _record_metric(self.__file_lock, "acquire", wait_time)
+                        break
+                now = time.time()
+                remaining = None
+                if timeout is not None:
+                    remaining = start_time + timeout - now
+                    if remaining <= 0:
+                        if _metrics_enabled:
+                            wait_time = now - start_time
+                            _record_metric(self.__file_lock, "timeout", wait_time)
+                        raise Timeout(f"Unable to acquire {self}")
+                attempt += 1
+                if _metrics_enabled:
+                    _record_metric(self.__file_lock, "retry")
+                policy = self.__file_lock._retry_policy
+                delay = policy.next_delay(attempt, delay, remaining)
+                await asyncio.sleep(delay)
+
+    async def release(self) -> None:
+        """
+        Releases the lock.
+
+        :raises InvalidRelease: raised when we don't own the lock
+        """
+        self.__file_lock.release()
+
+    def locked(self) -> bool:
+        """
+        True if we hold the lock.
+        """
+        return self.__file_lock.locked()
+
+    def getpid(self) -> int | None:
+        """
+        The PID of the process that holds the lock, if any. Otherwise returns `None`.
+        """
+        return self.__file_lock.getpid()
+
+    async def __aenter__(self) -> AsyncFileLock:
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        await self.release()
+
+    def __str__(self) -> str:
+        return f"AsyncFileLock('{self.lock_file}')"
+
+    __repr__ = __str__
+
+
+class SharedFileLock:
+    """
+    A readers-writer lock built on the lock file protocol. Any number of
+    processes may hold the lock in shared mode at the same time, but a
+    process holding it in exclusive mode excludes all others. An
+    :py:class:`openlock.SharedFileLock` object supports the context
+    manager protocol.
+
+    The exclusive lock is a :py:class:`openlock.FileLock` on `lock_file`.
+    Shared holders are recorded by token files in the directory
+    `lock_file` with suffix `.readers`. A writer first acquires the
+    :py:class:`openlock.FileLock` and then waits for the existing readers
+    to leave. New readers do not enter while a writer holds or waits for
+    the lock, so writers are not starved. Tokens of dead readers are
+    removed.
+    """
+
+    lock_file: Path
+    """
+    The `Path` object representing the lock file.
+    """
+    timeout: float | None
+    """
+    The value of the timeout parameter.
+    """
+    shared: bool
+    """
+    The value of the shared parameter.
+    """
+    __file_lock: FileLock
+    __readers: Path
+    __token: Path | None
+    __lock: threading.Lock
+
+    def __init__(
+        self,
+        lock_file: str | Path = "openlock.lock",
+        timeout: float | None = None,
+        shared: bool = True,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        :param lock_file: the underlying file used for locking;
+          the calling process should have read/write access to it and to
+          its directory
+        :param timeout: the default for the corresponding argument of
+          :py:meth:`openlock.SharedFileLock.acquire`
+        :param shared: `True` for shared (read) access, `False` for
+          exclusive (write) access
+        :param retry_policy: overrides the `retry_policy` option
+        """
+        self.__file_lock = FileLock(lock_file, timeout, retry_policy=retry_policy)
+        self.lock_file = self.__file_lock.lock_file
+        self.timeout = timeout
+        self.shared = shared
+        self.__readers = Path(f"{self.lock_file}.readers")
+        self.__token = None
+        self.__lock = threading.Lock()
+
+    def __live_readers(self) -> int:
+        count = 0
+        try:
+            entries = list(os.scandir(self.__readers))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith(".reader"):
+                continue
+            try:
+                with open(entry.path, errors="replace") as f:
+                    lock_state = _parse_lock_file(f.readlines())
+            except FileNotFoundError:
+                continue
+            if lock_state["state"] == "locked" and _holder_state_valid(lock_state):
+                count += 1
+                continue
+            logger.debug("Removing reader token '%s': %s", entry.path, lock_state)
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        return count
+
+    def __try_acquire_shared(self) -> bool:
+        os.makedirs(self.__readers, exist_ok=True)
+        pid = os.getpid()
+        token = self.__readers / f"{pid}-{os.urandom(4).hex()}.reader"
+        _write_file(token, _lock_file_data(pid, _own_name(), _get_own_starttime()))
+        # The token is visible before we look at the writer, and a writer
+        # looks at the tokens after it has taken the lock file. So either
+        # we see the writer or it sees us.
+        if not self.__file_lock.locked():
+            self.__token = token
+            atexit.register(self.__remove_token)
+            return True
+        os.remove(token)
+        return False
+
+    def __remove_token(self) -> None:
+        if self.__token is not None:
+            try:
+                os.remove(self.__token)
+            except OSError:
+                pass
+
+    def acquire(self, timeout: float | None = None) -> None:
+        """
+        Attempts to acquires the lock.
+
+        :param timeout: specifies the maximum waiting time in seconds
+          before a :py:exc:`Timeout` exception is raised
+
+        :raises Timeout: raised when the waiting time for acquiring
+          the lock has expired
+        :raises InvalidLockFile: raised when openlock is unable to create a
+          valid lock file
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start_time = time.time()
+        attempt, delay = 0, 0.0
+        with self.__lock:
+            if self.shared:
+                if self.__token is None and self.__try_acquire_shared():
+                    return
+            else:
+                self.__file_lock.acquire(timeout)
+                if self.__live_readers() == 0:
+                    return
+            while True:
+                remaining = None
+                if timeout is not None:
+                    remaining = start_time + timeout - time.time()
+                    if remaining <= 0:
+                        if not self.shared:
+                            self.__file_lock.release()
+                        raise Timeout(f"Unable to acquire {self}")
+                attempt += 1
+                policy = self.__file_lock._retry_policy
+                delay = policy.next_delay(attempt, delay, remaining)
+                time.sleep(delay)
+                if self.shared:
+                    if self.__token is None and self.__try_acquire_shared():
+                        return
+                elif self.__live_readers() == 0:
+                    return
+
+    def release(self) -> None:
+        """
+        Releases the lock.
+
+        :raises InvalidRelease: raised when we don't own the lock
+        """
+        with self.__lock:
+            if not self.shared:
+                self.__file_lock.release()
+                return
+            if self.__token is None:
+                raise InvalidRelease(f"Attempt at releasing {self} which we do not own")
+            self.__remove_token()
+            atexit.unregister(self.__remove_token)
+            self.__token = None
+
+    def locked(self) -> bool:
+        """
+        True if we hold the lock.
+        """
+        if self.shared:
+            return self.__token is not None
+        return self.__file_lock._owned
+
+    def __enter__(self) -> SharedFileLock:
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.release()
+
+    def __str__(self) -> str:
+        return f"SharedFileLock('{self.lock_file}', shared={self.shared})"
+
+    __repr__ = __str__
+
+
+class FileSemaphore:
+    """
+    A counting lock built on the lock file protocol: at most `slots`
+    holders at the same time. An :py:class:`openlock.FileSemaphore`
+    object supports the context manager protocol.
+
+    Each slot is a :py:class:`openlock.FileLock` on a lock file
+    `slot-<i>.lock` in the directory `path`. A free slot is found with a
+    single scan of the directory. Only if there is none are the holders
+    of the slots checked, together as in :py:func:`openlock.inspect`,
+    and slots of dead holders are taken over like stale locks.
+
+    An object may hold several slots. Each call to
+    :py:meth:`openlock.FileSemaphore.release` frees the slot acquired
+    last.
+    """
+
+    path: Path
+    """
+    The `Path` object representing the directory of the slot files.
+    """
+    slots: int
+    """
+    The maximal number of holders.
+    """
+    timeout: float | None
+    """
+    The value of the timeout parameter.
+    """
+    __retry_policy: RetryPolicy
+    __locks: list[FileLock]
+    __indices: dict[str, int]
+    __held: list[int]
+    __lock: threading.Lock
+
+    def __init__(
+        self,
+        path: str | Path = "openlock.sem",
+        slots: int = 1,
+        timeout: float | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        :param path: the directory containing the slot files; it is
+          created if it does not exist
+        :param slots: the maximal number of holders
+        :param timeout: the default for the corresponding argument of
+          :py:meth:`openlock.FileSemaphore.acquire`
+        :param retry_policy: overrides the `retry_policy` option
+        """
+        if slots < 1:
+            raise ValueError("The number of slots should be positive")
+        self.path = Path(path)
+        self.slots = slots
+        self.timeout = timeout
+        if retry_policy is None:
+            retry_policy = _defaults["retry_policy"]
+        if retry_policy is None:
+            retry_policy = FixedRetry(_defaults["retry_period"])
+        self.__retry_policy = retry_policy
+        self.__locks = [
+            FileLock(self.path / f"slot-{i}.lock", retry_policy=retry_policy)
+            for i in range(slots)
+        ]
+        self.__indices = {lock.lock_file.name: i for i, lock in enumerate(self.__locks)}
+        self.__held = []
+        self.__lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def __try_slot(self, index: int) -> bool:
+        try:
+            self.__locks[index].acquire(timeout=0)
+        except Timeout:
+            return False
+        with self.__lock:
+            self.__held.append(index)
+        logger.debug("%s: slot %s acquired", self, index)
+        return True
+
+    def __try_acquire(self) -> bool:
+        try:
+            present = {entry.name for entry in os.scandir(self.path)}
+        except FileNotFoundError:
+            os.makedirs(self.path, exist_ok=True)
+            present = set()
+        free = [i for name, i in self.__indices.items() if name not in present]
+        # spread concurrent acquirers over the free slots
+        random.shuffle(free)
+        for index in free:
+            if self.__try_slot(index):
+                return True
+        if free:
+            # all free slots were taken in the meantime
+            return False
+        for info in inspect(self.path, "slot-*.lock"):
+            index_ = self.__indices.get(info.path.name)
+            if index_ is not None and info.state != "locked":
+                if self.__try_slot(index_):
+                    return True
+        return False
+
+    def acquire(self, timeout: float | None = None) -> None:
+        """
+        Attempts to acquire a slot.
+
+        :param timeout: specifies the maximum waiting time in seconds
+          before a :py:exc:`Timeout` exception is raised
+
+        :raises Timeout: raised when the waiting time for acquiring
+          a slot has expired
+        :raises InvalidLockFile: raised when openlock is unable to create a
+          valid lock file
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start_time = time.time()
+        attempt, delay = 0, 0.0
+        while not self.__try_acquire():
+            remaining = None
+            if timeout is not None:
+                remaining = start_time + timeout - time.time()
+                if remaining <= 0:
+                    raise Timeout(f"Unable to acquire {self}")
+            attempt += 1
+            delay = self.__retry_policy.next_delay(attempt, delay, remaining)
+            time.sleep(delay)
+
+    def release(self) -> None:
+        """
+        Releases the slot acquired last.
+
+        :raises InvalidRelease: raised when we don't hold a slot
+        """
+        with self.__lock:
+            if not self.__held:
+                raise InvalidRelease(f"Attempt at releasing {self} which we do not own")
+            index = self.__held.pop()
+        self.__locks[index].release()
+
+    def locked(self) -> bool:
+        """
+        True if we hold a slot.
+        """
+        return bool(self.__held)
+
+    @property
+    def slot(self) -> int | None:
+        """
+        The index of the slot acquired last, if we hold a slot. Otherwise
+        `None`.
+        """
+        with self.__lock:
+            return self.__held[-1] if self.__held else None
+
+    def __enter__(self) -> FileSemaphore:
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.release()
+
+    def __str__(self) -> str:
+        return f"FileSemaphore('{self.path}', slots={self.slots})"
+
+    __repr__ = __str__
+
+
+class _PoolLock(FileLock):
+    # A lock of a LockPool. It counts the threads which hold it or wait for
+    # it, so that the pool does not evict it under them.
+
+    users: int
+    __pool_lock: threading.Lock
+
+    def __init__(
+        self,
+        pool_lock: threading.Lock,
+        lock_file: str | Path,
+        timeout: float | None,
+        retry_policy: RetryPolicy | None,
+    ) -> None:
+        super().__init__(lock_file, timeout, retry_policy=retry_policy, reentrant=True)
+        self.users = 0
+        self.__pool_lock = pool_lock
+
+    def acquire(self, timeout: float | None = None) -> None:
+        with self.__pool_lock:
+            self.users += 1
+        try:
+            super().acquire(timeout)
+        except BaseException:
+            with self.__pool_lock:
+                self.users -= 1
+            raise
+
+    def release(self) -> None:
+        super().release()
+        with self.__pool_lock:
+            self.users -= 1
+
+
+class LockPool:
+    """
+    A pool of locks indexed by keys. A key is hashed to one of `stripes`
+    lock files in `directory`, so the number of lock files is bounded
+    however many distinct keys are used. Keys sharing a lock file
+    exclude each other.
+
+    The :py:class:`openlock.FileLock` objects are reentrant, so that a
+    thread may hold the locks of several keys that hash to the same lock
+    file. At most `cache_size` of them are kept, in a least recently used
+    cache. Locks which are held or waited for are never evicted, and an
+    evicted lock is returned again as long as it is referenced.
+    """
+
+    directory: Path
+    """
+    The `Path` object representing the directory of the lock files.
+    """
+    stripes: int
+    """
+    The number of lock files.
+    """
+    cache_size: int
+    """
+    The maximal number of cached :py:class:`openlock.FileLock` objects.
+    """
+    timeout: float | None
+    """
+    The value of the timeout parameter.
+    """
+    __retry_policy: RetryPolicy | None
+    __locks: OrderedDict[int, _PoolLock]
+    __evicted: weakref.WeakValueDictionary[int, _PoolLock]
+    __lock: threading.Lock
+
+    def __init__(
+        self,
+        directory: str | Path,
+        stripes: int = 64,
+        cache_size: int = 128,
+        timeout: float | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        :param directory: the directory containing the lock files; it is
+          created if it does not exist
+        :param stripes: the number of lock files
+        :param cache_size: the maximal number of cached
+          :py:class:`openlock.FileLock` objects
+        :param timeout: the default timeout of the locks
+        :param retry_policy: overrides the `retry_policy` option
+        """
+        if stripes < 1:
+            raise ValueError("The number of stripes should be positive")
+        self.directory = Path(directory)
+        self.stripes = stripes
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.__retry_policy = retry_policy
+        self.__locks = OrderedDict()
+        self.__evicted = weakref.WeakValueDictionary()
+        self.__lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def stripe(self, key: str | bytes) -> int:
+        """
+        The index of the lock file used for `key`. This does not depend
+        on the process.
+
+        :param key: the key
+        """
+        if isinstance(key, str):
+            key = key.encode()
+        return zlib.crc32(key) % self.stripes
+
+    def lock(self, key: str | bytes) -> FileLock:
+        """
+        The lock for `key`.
+
+        :param key: the key
+        """
+        index = self.stripe(key)
+        with self.__lock:
+            lock = self.__locks.get(index)
+            if lock is not None:
+                self.__locks.move_to_end(index)
+                return lock
+            # A thread may have been given an evicted lock but not yet have
+            # acquired it. A second lock on the same file would not be
+            # reentrant with it.
+            lock = self.__evicted.pop(index, None)
+            if lock is None:
+                lock = _PoolLock(
+                    self.__lock,
+                    self.directory / f"stripe-{index}.lock",
+                    self.timeout,
+                    self.__retry_policy,
+                )
+            self.__locks[index] = lock
+            if len(self.__locks) > self.cache_size:
+                for index_, lock_ in self.__locks.items():
+                    if lock_.users == 0 and not lock_._owned:
+                        self.__evicted[index_] = self.__locks.pop(index_)
+                        break
+            return lock
+
+    def __len__(self) -> int:
+        return len(self.__locks)
+
+    def __str__(self) -> str:
+        return f"LockPool('{self.directory}', stripes={self.stripes})"
+
+    __repr__ = __str__
+
+
+def _canonical_order(locks: Iterable[FileLock]) -> list[FileLock]:
+    # The same object may be given several times, but two objects on the
+    # same lock file would wait for each other.
+    unique: dict[str, FileLock] = {}
+    for lock in locks:
+        other = unique.setdefault(os.path.realpath(lock.lock_file), lock)
+        if other is not lock:
+            raise ValueError(f"{other} and {lock} use the same lock file")
+    return [unique[path] for path in sorted(unique)]
+
+
+def acquire_all(
+    locks: Iterable[FileLock],
+    timeout: float | None = None,
+    retry_policy: RetryPolicy | None = None,
+) -> None:
+    """
+    Acquires several locks without deadlocking against other processes
+    doing the same. The locks are taken in the order of their resolved
+    lock file paths. If one of them is not available then the locks
+    taken so far are released and, after a delay determined by the
+    retry policy, everything is retried.
+
+    :param locks: the locks to acquire
+    :param timeout: the maximum waiting time in seconds for all locks
+      together
+    :param retry_policy: overrides the `retry_policy` option
+
+    :raises Timeout: raised when the waiting time for acquiring
+      the locks has expired; no locks are held in that case
+    :raises InvalidLockFile: raised when openlock is unable to create a
+      valid lock file
+    :raises ValueError: raised when two of the locks are different
+      objects on the same lock file
+    """
+    ordered = _canonical_order(locks)
+    if retry_policy is None:
+        retry_policy = _defaults["retry_policy"]
+    if retry_policy is None:
+        retry_policy = FixedRetry(_defaults["retry_period"])
+    start_time = time.time()
+    attempt, delay = 0, 0.0
+    while True:
+        held: list[FileLock] = []
+        try:
+            for lock in ordered:
+                lock.acquire(timeout=0)
+                held.append(lock)
+            return
+        except Timeout:
+            pass
+        finally:
+            if len(held) != len(ordered):
+                for lock in reversed(held):
+                    lock.release()
+        remaining = None
+        if timeout is not None:
+            remaining = start_time + timeout - time.time()
+            if remaining <= 0:
+                raise Timeout(f"Unable to acquire {ordered}")
+        attempt += 1
+        delay = retry_policy.next_delay(attempt, delay, remaining)
+        time.sleep(delay)
+
+
+def release_all(locks: Iterable[FileLock]) -> None:
+    """
+    Releases locks acquired by :py:func:`openlock.acquire_all`, in the
+    reverse order.
+
+    :param locks: the locks to release
+
+    :raises InvalidRelease: raised when we don't own one of the locks;
+      the other locks are still released
+    """
+    error = None
+    for lock in reversed(_canonical_order(locks)):
+        try:
+            lock.release()
+        except InvalidRelease as e:
+            error = e
+    if error is not None:
+        raise error
+
+
+class MultiLock:
+    """
+    A group of locks which are acquired and released together with
+    :py:func:`openlock.acquire_all` and :py:func:`openlock.release_all`.
+    An :py:class:`openlock.MultiLock` object supports the context manager
+    protocol.
+    """
+
+    locks: list[FileLock]
+    """
+    The locks, in the order in which they are acquired.
+    """
+    timeout: float | None
+    """
+    The value of the timeout parameter.
+    """
+    __retry_policy: RetryPolicy | None
+
+    def __init__(
+        self,
+        locks: Iterable[FileLock],
+        timeout: float | None = None,
+        retry_policy: RetryPolicy | None = None,
+    ) -> None:
+        """
+        :param locks: the locks
+        :param timeout: the default for the corresponding argument of
+          :py:meth:`openlock.MultiLock.acquire`
+        :param retry_policy: overrides the `retry_policy` option
+
+        :raises ValueError: raised when two of the locks are different
+          objects on the same lock file
+        """
+        self.locks = _canonical_order(locks)
+        self.timeout = timeout
+        self.__retry_policy = retry_policy
+
+    def acquire(self, timeout: float | None = None) -> None:
+        """
+        Acquires all locks.
+
+        :param timeout: the maximum waiting time in seconds for all locks
+          together
+
+        :raises Timeout: raised when the waiting time for acquiring
+          the locks has expired
+        :raises InvalidLockFile: raised when openlock is unable to create a
+          valid lock file
+        """
+        if timeout is None:
+            timeout = self.timeout
+        acquire_all(self.locks, timeout, retry_policy=self.__retry_policy)
+
+    def release(self) -> None:
+        """
+        Releases all locks.
+
+        :raises InvalidRelease: raised when we don't own one of the locks
+        """
+        release_all(self.locks)
+
+    def __enter__(self) -> MultiLock:
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        self.release()
+
+    def __str__(self) -> str:
+        return f"MultiLock({self.locks})"
+
+    __repr__ = __str__
+
+
+_T = TypeVar("_T")
+
+
+def _load_result(path: Path, max_age: float | None) -> tuple[bool, Any]:
+    # (True, result) if a usable result is cached in `path`, else
+    # (False, None).
+    try:
+        with open(path, "rb") as f:
+            if (
+                max_age is not None
+                and time.time() - os.fstat(f.fileno()).st_mtime > max_age
+            ):
+                return False, None
+            return True, pickle.load(f)
+    except FileNotFoundError:
+        return False, None
+    except Exception as e:
+        logger.warning("Unable to load the cached result '%s': %s", path, e)
+        return False, None
+
+
+def _evict_results(
+    cache_dir: Path, max_age: float | None, max_size: int | None
+) -> None:
+    # Remove the results older than max_age, and then the oldest results
+    # until their total size is at most max_size.
+    now = time.time()
+    results = []
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".pickle"):
+            continue
+        try:
+            st = entry.stat()
+        except FileNotFoundError:
+            continue
+        if max_age is not None and now - st.st_mtime > max_age:
+            logger.debug("Evicting the cached result '%s': too old", entry.path)
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+            continue
+        results.append((st.st_mtime, st.st_size, Path(entry.path)))
+    if max_size is None:
+        return
+    results.sort()
+    total = sum(size for _, size, _ in results)
+    for _, size, path in results:
+        if total <= max_size:
+            break
+        logger.debug("Evicting the cached result '%s': cache too large", path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def single_flight(
+    cache_dir: str | Path,
+    timeout: float | None = None,
+    max_age: float | None = None,
+    max_size: int | None = None,
+) -> Callable[[Callable[..., _T]], Callable[..., _T]]:
+    """
+    A decorator which caches the results of a function in a directory,
+    so that they are computed only once by all processes using it. The
+    result of a call is stored in a file whose name is derived from the
+    function and its arguments. If it is not there yet, then the caller
+    takes a :py:class:`openlock.FileLock` for the arguments and computes
+    it, while the other callers with the same arguments wait for the lock
+    and then load the result.
+
+    The arguments and the results should be picklable, and the arguments
+    should pickle to the same bytes when they are equal. Only trusted
+    processes should have write access to `cache_dir`, since the results
+    are unpickled. Exceptions are not cached: a waiting caller then
+    computes the result itself.
+
+    :param cache_dir: the directory of the results and of the lock files;
+      it is created if it does not exist
+    :param timeout: the maximum waiting time in seconds for the lock of a
+      call, after which :py:exc:`Timeout` is raised
+    :param max_age: if not `None` then results older than this many
+      seconds are not used, and are evicted
+    :param max_size: if not `None` then the oldest results are evicted
+      when the total size of the results exceeds this many bytes
+    """
+    cache_path = Path(cache_dir)
+    if max_age is not None and max_age <= 0:
+        raise ValueError("The maximal age should be positive")
+    if max_size is not None and max_size < 0:
+        raise ValueError("The maximal size should not be negative")
+
+    def decorator(func: Callable[..., _T]) -> Callable[..., _T]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> _T:
+            call = (func.__module__, func.__qualname__, args, sorted(kwargs.items()))
+            key = hashlib.sha256(pickle.dumps(call)).hexdigest()
+            path = cache_path / f"{key}.pickle"
+            found, result = _load_result(path, max_age)
+            if found:
+                return result  # type: ignore[no-any-return]
+            os.makedirs(cache_path, exist_ok=True)
+            with FileLock(cache_path / f"{key}.lock", timeout):
+                # computed while we were waiting?
+                found, result = _load_result(path, max_age)
+                if found:
+                    return result  # type: ignore[no-any-return]
+                result = func(*args, **kwargs)
+                # readers never see a partially written result
+                _write_file(path, pickle.dumps(result))
+                logger.debug("Result of %s cached in '%s'", func.__qualname__, path)
+            if max_age is not None or max_size is not None:
+                _evict_results(cache_path, max_age, max_size)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class LockInfo:
+    """
+    The state of a lock file, as reported by :py:func:`openlock.inspect`.
+    """
+
+    path: Path
+    """
+    The `Path` object representing the lock file.
+    """
+    state: str
+    """
+    `"locked"` if the lock file is valid, `"stale"` if its holder is gone
+    and `"invalid"` if its contents cannot be parsed
+    """
+    pid: int | None
+    """
+    The PID of the holder, if the lock file is not invalid.
+    """
+    name: str | None
+    """
+    The name of the holder, if the lock file is not invalid.
+    """
+
+    def __init__(
+        self, path: Path, state: str, pid: int | None = None, name: str | None = None
+    ) -> None:
+        self.path = path
+        self.state = state
+        self.pid = pid
+        self.name = name
+
+    def __repr__(self) -> str:
+        return (
+            f"LockInfo(path='{self.path}', state={self.state!r}, "
+            f"pid={self.pid}, name={self.name!r})"
+        )
+
+
+def inspect(directory: str | Path = ".", pattern: str = "*.lock") -> list[LockInfo]:
+    """
+    Reports the state of all lock files in a directory. This is much
+    faster than calling :py:meth:`openlock.FileLock.getpid` for each of
+    them, since the holders are checked together (with a single `ps` if
+    `/proc` is not available).
+
+    :param directory: the directory containing the lock files
+    :param pattern: a shell-style pattern for the names of the lock files
+
+    :return: a list of :py:class:`openlock.LockInfo` objects, sorted by path
+    """
+    paths = []
+    for entry in os.scandir(directory):
+        if fnmatch.fnmatch(entry.name, pattern) and entry.is_file():
+            paths.append(Path(entry.path))
+    paths.sort()
+    infos = []
+    lock_states = []
+    for path in paths:
+        try:
+            with open(path, errors="replace") as f:
+                lock_state = _parse_lock_file(f.readlines())
+        except FileNotFoundError:
+            # released in the meantime
+            continue
+        if lock_state["state"] == "locked":
+            lock_states.append(lock_state)
+            infos.append(
+                LockInfo(path, "locked", lock_state["pid"], lock_state["name"])
+            )
+        else:
+            infos.append(LockInfo(path, "invalid"))
+    valid = iter(_holder_states_valid(lock_states))
+    for info in infos:
+        if info.state == "locked" and not next(valid):
+            info.state = "stale"
+    return infos
+
+
+def reap(directory: str | Path = ".", pattern: str = "*.lock") -> list[Path]:
+    """
+    Removes the stale and invalid lock files in a directory, so that
+    processes acquiring the locks later find them free. A lock file is
+    removed by acquiring and releasing the lock, so it is subject to the
+    same race protections as the takeover of a stale lock by
+    :py:meth:`openlock.FileLock.acquire`. The lock files are handled
+    concurrently, so the `race_delay` is not paid for each of them.
+
+    :param directory: the directory containing the lock files
+    :param pattern: a shell-style pattern for the names of the lock files
+
+    :return: the paths of the removed lock files, sorted
+    """
+    paths = [
+        info.path for info in inspect(directory, pattern) if info.state != "locked"
+    ]
+    if not paths:
+        return []
+
+    def reap_one(path: Path) -> bool:
+        if not path.exists():
+            # released in the meantime
+            return False
+        lock = FileLock(path)
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            # taken over in the meantime
+            return False
+        lock.release()
+        logger.debug("Lock file '%s' reaped", path)
+        return True
+
+    max_workers = min(32, len(paths))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        reaped = list(executor.map(reap_one, paths))
+    return [path for path, reaped_ in zip(paths, reaped) if reaped_]
+
+
+class Reaper:
+    """
+    Calls :py:func:`openlock.reap` on a directory at regular intervals,
+    so that stale lock files left by crashed processes are removed off
+    the critical path of the processes acquiring the locks.
+
+    The reaper is started with `python -m openlock reap <directory>`.
+    """
+
+    directory: Path
+    """
+    The `Path` object representing the directory.
+    """
+    pattern: str
+    """
+    The shell-style pattern for the names of the lock files.
+    """
+    interval: float
+    """
+    The time in seconds between two scans of the directory.
+    """
+    __stop: threading.Event
+    __thread: threading.Thread | None
+
+    def __init__(
+        self,
+        directory: str | Path = ".",
+        pattern: str = "*.lock",
+        interval: float = 10.0,
+    ) -> None:
+        """
+        :param directory: the directory containing the lock files
+        :param pattern: a shell-style pattern for the names of the lock files
+        :param interval: the time in seconds between two scans of the
+          directory
+        """
+        if interval <= 0:
+            raise ValueError("The interval should be positive")
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.interval = interval
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def run(self) -> None:
+        """
+        Scans the directory until :py:meth:`openlock.Reaper.stop` is
+        called.
+        """
+        logger.info("Reaping '%s' every %ss", self.directory, self.interval)
+        while True:
+            try:
+                reaped = reap(self.directory, self.pattern)
+            except OSError as e:
+                logger.error("Error reaping '%s': %s", self.directory, e)
+            else:
+                if reaped:
+                    logger.info(
+                        "Removed %d stale lock file(s) from '%s'",
+                        len(reaped),
+                        self.directory,
+                    )
+            if self.__stop.wait(self.interval):
+                break
+        logger.info("Reaper of '%s' stopped", self.directory)
+
+    def start(self) -> None:
+        """
+        Runs :py:meth:`openlock.Reaper.run` in a daemon thread.
+        """
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the reaper. This may be called from any thread.
+        """
+        self.__stop.set()
+        thread = self.__thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def __str__(self) -> str:
+        return f"Reaper('{self.directory}')"
+
+    __repr__ = __str__
+
+
+class LockServer:
+    """
+    A lock server, which grants locks to clients over a Unix domain
+    socket. Clients are queued per lock file and woken up as soon as the
+    lock is released. A lock is released when the client closes its
+    connection, so the locks of clients that die are released at once.
+
+    A :py:class:`openlock.FileLock` uses the server if the `server` option
+    is set to the path of its socket. The server is optional: clients
+    still create the lock file after the server has granted the lock, so
+    they exclude processes that do not use the server, and they fall back
+    to polling the lock file if the server is not reachable.
+
+    The server is started with `python -m openlock server <socket>`.
+    """
+
+    socket_path: str
+    """
+    The path of the Unix domain socket.
+    """
+    __queues: dict[bytes, deque[asyncio.StreamWriter]]
+    __handlers: set[asyncio.Task[None]]
+    __loop: asyncio.AbstractEventLoop | None
+    __stop: asyncio.Event | None
+
+    def __init__(self, socket_path: str) -> None:
+        """
+        :param socket_path: the path of the Unix domain socket
+        """
+        self.socket_path = socket_path
+        self.__queues = {}
+        self.__handlers = set()
+        self.__loop = None
+        self.__stop = None
+
+    async def serve(self) -> None:
+        """
+        Serves clients until :py:meth:`openlock.LockServer.stop` is called.
+
+        :raises OpenLockException: raised when another server is listening
+          on the socket
+        """
+        if os.path.exists(self.socket_path):
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(self.socket_path)
+            except OSError:
+                # left behind by a server that has died
+                os.remove(self.socket_path)
+            else:
+                raise OpenLockException(
+                    f"A lock server is already listening on '{self.socket_path}'"
+                )
+            finally:
+                conn.close()
+        self.__loop = asyncio.get_running_loop()
+        self.__stop = asyncio.Event()
+        server = await asyncio.start_unix_server(self.__handle, path=self.socket_path)
+        logger.info("Lock server listening on '%s'", self.socket_path)
+        try:
+            await self.__stop.wait()
+        finally:
+            server.close()
+            for queue in self.__queues.values():
+                for writer in queue:
+                    writer.close()
+            # the handlers see the connections being closed
+            await asyncio.gather(*self.__handlers, return_exceptions=True)
+            await server.wait_closed()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+            logger.info("Lock server on '%s' stopped", self.socket_path)
+
+    def run(self) -> None:
+        """
+        Runs :py:meth:`openlock.LockServer.serve` in a new event loop.
+        """
+        asyncio.run(self.serve())
+
+    def stop(self) -> None:
+        """
+        Stops the server. This may be called from any thread.
+        """
+        if self.__loop is not None and self.__stop is not None:
+            self.__loop.call_soon_threadsafe(self.__stop.set)
+
+    async def __handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # Protocol: the client sends "ACQUIRE <path>" and the server
+        # replies "GRANTED" when the client holds the lock. With
+        # "TRY <path>" the server replies "BUSY" at once if the lock is
+        # held.
+        task = asyncio.current_task()
+        assert task is not None
+        self.__handlers.add(task)
+        try:
+            request = await reader.readline()
+            command, _, path = request.rstrip(b"\n").partition(b" ")
+            if command not in (b"ACQUIRE", b"TRY") or not path:
+                writer.write(b"ERROR\n")
+                return
+            queue = self.__queues.setdefault(path, deque())
+            if command == b"TRY" and queue:
+                writer.write(b"BUSY\n")
+                return
+            queue.append(writer)
+            if len(queue) == 1:
+                writer.write(b"GRANTED\n")
+            try:
+                while await reader.read(1024):
+                    pass
+            finally:
+                self.__remove(path, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self.__handlers.discard(task)
+
+    def __remove(self, path: bytes, writer: asyncio.StreamWriter) -> None:
+        queue = self.__queues[path]
+        head = queue[0] is writer
+        queue.remove(writer)
+        if not queue:
+            del self.__queues[path]
+        elif head:
+            queue[0].write(b"GRANTED\n")
+
+    def __str__(self) -> str:
+        return f"LockServer('{self.socket_path}')"
+
+    __repr__ = __str__
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m openlock", description="Tools for openlock."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    server_parser = subparsers.add_parser("server", help="run a lock server")
+    server_parser.add_argument("socket", help="path of the Unix domain socket")
+    reap_parser = subparsers.add_parser("reap", help="remove stale lock files")
+    reap_parser.add_argument("directory", help="directory containing the lock files")
+    reap_parser.add_argument(
+        "--pattern", default="*.lock", help="pattern for the names of the lock files"
+    )
+    reap_parser.add_argument(
+        "--interval", type=float, default=10.0, help="seconds between two scans"
+    )
+    reap_parser.add_argument(
+        "--once", action="store_true", help="scan the directory once and exit"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    if args.command == "server":
+        try:
+            LockServer(args.socket).run()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "reap":
+        if args.once:
+            for path in reap(args.directory, args.pattern):
+                print(path)
+            return
+        try:
+            Reaper(args.directory, args.pattern, args.interval).run()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+Fault injection stress test for openlock.
+
+Run ``python stress.py`` from a checkout. A number of worker processes
+compete for a single lock while faults are injected:
+
+* ``kill``: the holder of the lock is killed with SIGKILL;
+* ``garbage``: a process acquires the lock, overwrites the lock file with
+  random bytes and exits without cleaning up;
+* ``truncated``: the same, but the lock file is cut short;
+* ``pid_reuse``: the same, but the lock file names another live process
+  (this one), as if the PID of the holder had been reused.
+
+With ``--slow-write`` the workers also sleep up to that many seconds
+before every write of a lock file that replaces an existing one, which is
+what happens when a stale lock is taken over.
+
+Mutual exclusion is checked in two ways. In its critical section a worker
+writes its PID to a marker file, increments a counter file (read, sleep
+``--hold`` seconds, write) and checks that the marker is unchanged. At the
+end the counter must not be smaller than the number of completed
+critical sections. The report gives the distribution of the recovery
+latency of each kind of fault, i.e. the time from the fault until the
+next acquisition. A fault after which the lock is not recovered within
+``--stuck-after`` seconds is counted as stuck, and the lock file is
+removed.
+
+The report is printed as JSON. The exit status is 1 if mutual exclusion
+was violated. The harness needs SIGKILL, so it does not run on Windows.
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import warnings
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+try:
+    from . import openlock  # type: ignore
+    from .bench import default_dirs, summary  # type: ignore
+except ImportError:
+    import openlock  # type: ignore
+    from bench import default_dirs, summary  # type: ignore
+
+Result = Dict[str, Any]
+
+FAULTS = ("kill", "garbage", "truncated", "pid_reuse")
+
+
+def write_atomic(path: str, data: str) -> None:
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as f:
+        f.write(data)
+    os.replace(temp_file, path)
+
+
+def read_text(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def holder_pid(lock_file: str) -> int | None:
+    try:
+        return int(read_text(lock_file).split("\n")[0])
+    except ValueError:
+        return None
+
+
+def worker(
+    directory: str,
+    options: Dict[str, Any],
+    hold: float,
+    acquire_timeout: float,
+    slow_write: float,
+    deadline: float,
+    seed: float,
+) -> None:
+    openlock.set_defaults(**options)
+    # slow writes trigger the warning about slow systems
+    warnings.simplefilter("ignore")
+    if slow_write > 0:
+        rng = random.Random(seed)
+        write_file = openlock._write_file
+
+        def slow_write_file(path: Path, data: bytes) -> None:
+            time.sleep(rng.uniform(0, slow_write))
+            write_file(path, data)
+
+        openlock._write_file = slow_write_file
+    pid = os.getpid()
+    lock = openlock.FileLock(os.path.join(directory, "stress.lock"))
+    marker = os.path.join(directory, "marker")
+    counter = os.path.join(directory, "counter")
+    log = os.open(
+        os.path.join(directory, "logs", f"{pid}.log"),
+        os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+    )
+    while time.time() < deadline:
+        t = time.time()
+        try:
+            lock.acquire(timeout=acquire_timeout)
+        except openlock.Timeout:
+            os.write(log, b"timeout\n")
+            continue
+        except openlock.InvalidLockFile:
+            os.write(log, b"invalid\n")
+            continue
+        except Exception as e:
+            os.write(log, f"error {type(e).__name__}\n".encode())
+            time.sleep(options.get("retry_period", 0.3))
+            continue
+        acquired = time.time()
+        write_atomic(marker, str(pid))
+        count = int(read_text(counter) or 0)
+        time.sleep(hold)
+        write_atomic(counter, str(count + 1))
+        violation = read_text(marker) != str(pid)
+        lock.release()
+        os.write(log, f"acquire {acquired} {acquired - t} {int(violation)}\n".encode())
+    os.close(log)
+
+
+def fault_holder(lock_file: str, kind: str, pid: int, seed: float) -> None:
+    # Acquire the lock, damage the lock file and exit without cleaning up.
+    # Poll aggressively, so that the fault is not delayed by the workers.
+    openlock.set_defaults(retry_period=0.001)
+    rng = random.Random(seed)
+    lock = openlock.FileLock(lock_file)
+    lock.acquire()
+    data = read_text(lock_file)
+    if kind == "garbage":
+        content = bytes(rng.getrandbits(8) for _ in range(rng.randint(1, 64)))
+    elif kind == "truncated":
+        content = data[: rng.randrange(len(data))].encode()
+    else:
+        lines = data.split("\n")
+        lines[0] = str(pid)
+        content = "\n".join(lines).encode()
+    with open(lock_file, "wb") as f:
+        f.write(content)
+    os._exit(0)
+
+
+def recovered(lock_file: str, workers: Dict[int, Any]) -> bool:
+    # The lock file is gone or names a live worker.
+    if not os.path.exists(lock_file):
+        return True
+    pid = holder_pid(lock_file)
+    return pid in workers and workers[pid].is_alive()
+
+
+def stress(args: argparse.Namespace, directory: str) -> Result:
+    ctx = multiprocessing.get_context()
+    lock_file = os.path.join(directory, "stress.lock")
+    os.makedirs(os.path.join(directory, "logs"))
+    options = {
+        k: v
+        for k, v in (
+            ("race_delay", args.race_delay),
+            ("retry_period", args.retry_period),
+        )
+        if v is not None
+    }
+    rng = random.Random(args.seed)
+    start = time.time()
+    deadline = start + args.duration
+    workers: Dict[int, Any] = {}
+
+    def spawn() -> None:
+        p = ctx.Process(
+            target=worker,
+            args=(
+                directory,
+                options,
+                args.hold,
+                args.stuck_after,
+                args.slow_write,
+                deadline,
+                rng.random(),
+            ),
+        )
+        p.start()
+        workers[p.pid] = p
+
+    for _ in range(args.procs):
+        spawn()
+    faults: List[Tuple[str, float]] = []
+    stuck: Dict[str, int] = {kind: 0 for kind in args.faults}
+    skipped_kills = 0
+    while time.time() + 2 * args.fault_interval < deadline:
+        time.sleep(rng.uniform(0.5, 1.5) * args.fault_interval)
+        kind = rng.choice(args.faults)
+        if kind == "kill":
+            pid = holder_pid(lock_file)
+            if pid not in workers:
+                skipped_kills += 1
+                continue
+            os.kill(pid, signal.SIGKILL)
+            t = time.time()
+            workers.pop(pid).join()
+            spawn()
+        else:
+            p = ctx.Process(
+                target=fault_holder, args=(lock_file, kind, os.getpid(), rng.random())
+            )
+            p.start()
+            p.join()
+            t = time.time()
+        faults.append((kind, t))
+        while not recovered(lock_file, workers):
+            if time.time() - t > args.stuck_after:
+                stuck[kind] += 1
+                try:
+                    os.remove(lock_file)
+                except FileNotFoundError:
+                    pass
+                break
+            time.sleep(0.001)
+    for p in workers.values():
+        p.join(args.stuck_after + 1)
+        if p.is_alive():
+            p.kill()
+            p.join()
+    duration = time.time() - start
+
+    acquisitions: List[float] = []
+    waits: List[float] = []
+    violations = 0
+    events = {"timeout": 0, "invalid": 0, "error": 0}
+    for log in Path(directory, "logs").iterdir():
+        for line in log.read_text().splitlines():
+            fields = line.split()
+            if fields and fields[0] == "acquire" and len(fields) == 4:
+                acquisitions.append(float(fields[1]))
+                waits.append(float(fields[2]))
+                violations += int(fields[3])
+            elif fields and fields[0] in events:
+                events[fields[0]] += 1
+    acquisitions.sort()
+    counter = int(read_text(os.path.join(directory, "counter")) or 0)
+    lost_updates = max(0, len(acquisitions) - counter)
+    result: Result = {
+        "ok": violations == 0 and lost_updates == 0,
+        "acquisitions": len(acquisitions),
+        "throughput": len(acquisitions) / duration,
+        "wait": summary(waits),
+        "violations": violations,
+        "lost_updates": lost_updates,
+        "timeouts": events["timeout"],
+        "invalid_lock_files": events["invalid"],
+        "errors": events["error"],
+        "skipped_kills": skipped_kills,
+        "faults": {},
+    }
+    for kind in args.faults:
+        latencies = []
+        for kind_, t in faults:
+            if kind_ != kind:
+                continue
+            i = bisect.bisect_right(acquisitions, t)
+            if i < len(acquisitions):
+                latencies.append(acquisitions[i] - t)
+        result["faults"][kind] = {
+            "count": sum(kind_ == kind for kind_, _ in faults),
+            "stuck": stuck[kind],
+            "recovery": summary(latencies),
+        }
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fault injection stress test.")
+    parser.add_argument(
+        "--procs", type=int, default=8, help="number of competing processes"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="duration of the test"
+    )
+    parser.add_argument("--hold", type=float, default=0.001, help="time a lock is held")
+    parser.add_argument(
+        "--faults",
+        default=",".join(FAULTS),
+        help=f"comma separated faults to inject: {', '.join(FAULTS)} " "(default: all)",
+    )
+    parser.add_argument(
+        "--fault-interval",
+        type=float,
+        default=0.5,
+        help="average time between two faults",
+    )
+    parser.add_argument(
+        "--slow-write",
+        type=float,
+        default=0.0,
+        help="maximal artificial delay of a lock file rewrite",
+    )
+    parser.add_argument(
+        "--stuck-after",
+        type=float,
+        default=10.0,
+        help="time after which an unrecovered lock counts as stuck",
+    )
+    parser.add_argument("--race-delay", type=float, help="the race_delay option")
+    parser.add_argument("--retry-period", type=float, help="the retry_period option")
+    parser.add_argument("--seed", type=int, help="seed of the fault schedule")
+    parser.add_argument(
+        "--dir",
+        action="append",
+        dest="dirs",
+        help="directory in which a temporary directory for the lock files is "
+        "created; may be repeated (default: /dev/shm and the current directory)",
+    )
+    parser.add_argument("--output", help="write the report to this file")
+    args = parser.parse_args()
+    args.faults = [fault for fault in args.faults.split(",") if fault]
+    for fault in args.faults:
+        if fault not in FAULTS:
+            parser.error(f"unknown fault: '{fault}'")
+    if not args.faults:
+        parser.error("no faults to inject")
+    dirs = args.dirs or default_dirs()
+    results: Result = {}
+    for d in dirs:
+        temp_dir = tempfile.mkdtemp(prefix="openlock-stress-", dir=d)
+        try:
+            results[d] = stress(args, temp_dir)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    report = {
+        "openlock": openlock.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "options": {k: v for k, v in vars(args).items() if k != "output"},
+        "defaults": {k: repr(v) for k, v in openlock.get_defaults().items()},
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if not all(result["ok"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,50 @@
 from __future__ import annotations
 
+import asyncio
 import logging  # noqa: F401
+import multiprocessing
 import os
 import platform
+import shutil
 import subprocess
 import sys
+import threading
 import time
 import unittest
 from pathlib import Path
 from typing import Any
 
+import openlock
 from openlock import (
+    AsyncFileLock,
+    Deadlock,
+    DecorrelatedJitter,
+    ExponentialBackoff,
     FileLock,
+    FileSemaphore,
+    FixedRetry,
     InvalidLockFile,
     InvalidOption,
     InvalidRelease,
+    InvalidTransfer,
+    LockPool,
+    LockServer,
+    MultiLock,
+    Reaper,
+    RetryPolicy,
+    SharedFileLock,
     Timeout,
+    acquire_all,
+    disable_metrics,
+    enable_metrics,
     get_defaults,
+    get_metrics,
+    inspect,
     logger,
+    reap,
+    release_all,
     set_defaults,
+    single_flight,
 )
 
 if sys.version_info >= (3, 11):
@@ -32,6 +58,7 @@ IS_WINDOWS = "windows" in platform.system().lower()
 
 lock_file = "test.lock"
 other_lock_file = "test1.lock"
+lock_dir = "test_locks"
 defaults = get_defaults()
 
 
@@ -40,6 +67,24 @@ def show(mc: Any) -> None:
     logger.debug(f"{exception.__class__.__name__}: {str(exception)}")
 
 
+def dead_pid() -> int:
+    # The PID of a process that has exited.
+    p = subprocess.Popen([sys.executable, "-c", "pass"])
+    p.wait()
+    return p.pid
+
+
+def foreign_holder(path: str) -> subprocess.Popen[bytes]:
+    # A live process, with a lock file `path` naming it as the holder. The
+    # caller kills it.
+    p = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+    while not openlock._pid_valid(p.pid, "time.sleep"):
+        time.sleep(0.01)
+    with open(path, "w") as f:
+        f.write(f"{p.pid}\ntime.sleep\n")
+    return p
+
+
 class TestOpenLock(unittest.TestCase):
     def setUp(self) -> None:
         logging.disable(logging.DEBUG)
@@ -48,6 +93,11 @@ class TestOpenLock(unittest.TestCase):
                 os.remove(L)
             except OSError:
                 pass
+        shutil.rmtree(lock_file + ".readers", ignore_errors=True)
+        shutil.rmtree(lock_file + ".tickets", ignore_errors=True)
+        # forget the locks left behind by previous tests
+        openlock._local_locks.clear()
+        shutil.rmtree(lock_dir, ignore_errors=True)
         set_defaults(**defaults)
 
     def test_acquire_release(self) -> None:
@@ -92,6 +142,13 @@ class TestOpenLock(unittest.TestCase):
         r.acquire(timeout=0)
         self.assertTrue(os.getpid() == r.getpid())
         r.release()
+        # not even text
+        with open(lock_file, "wb") as f:
+            f.write(bytes(range(128, 256)))
+        self.assertIsNone(r.getpid())
+        r.acquire(timeout=0)
+        self.assertTrue(os.getpid() == r.getpid())
+        r.release()
 
     def test_timeout(self) -> None:
         r = FileLock(lock_file)
@@ -136,18 +193,31 @@ class TestOpenLock(unittest.TestCase):
             r.acquire(timeout=0)
 
     def test_options(self) -> None:
+        all_keys = {
+            "tries",
+            "retry_period",
+            "race_delay",
+            "wait_mode",
+            "adaptive_race_delay",
+            "retry_policy",
+            "server",
+        }
         option_keys = set(get_defaults().keys())
-        self.assertTrue(option_keys == {"tries", "retry_period", "race_delay"})
+        self.assertTrue(option_keys == all_keys)
         options: Defaults = {
             "tries": 5,
             "retry_period": 100.0,
             "race_delay": 100,
+            "wait_mode": "inotify",
+            "adaptive_race_delay": True,
+            "retry_policy": ExponentialBackoff(),
+            "server": "openlock.sock",
         }
         set_defaults(**options)
         options_ = get_defaults()
         self.assertTrue(options == options_)
         option_keys = set(options_)
-        self.assertTrue(option_keys == {"tries", "retry_period", "race_delay"})
+        self.assertTrue(option_keys == all_keys)
 
     def test_slow_system(self) -> None:
         r = FileLock(lock_file)
@@ -164,6 +234,9 @@ class TestOpenLock(unittest.TestCase):
         with self.assertRaises(InvalidOption) as e:
             set_defaults(tris=1)  # type: ignore
         self.assertTrue("tris" in str(e.exception))
+        with self.assertRaises(InvalidOption) as e:
+            set_defaults(wait_mode="busy")
+        self.assertTrue("busy" in str(e.exception))
 
     def test_default_lock_file(self) -> None:
         r = FileLock()
@@ -191,6 +264,1075 @@ class TestOpenLock(unittest.TestCase):
         tt = time.time()
         self.assertTrue(tt - t > 0.8)
 
+    @unittest.skipUnless(openlock.HAS_PROCFS, "no /proc filesystem")
+    def test_pid_valid_proc(self) -> None:
+        pid, name = os.getpid(), Path(sys.argv[0].split()[0]).stem
+        dead = dead_pid()
+        for pid_, name_ in ((pid, name), (pid, "dummy"), (dead, "c")):
+            self.assertEqual(
+                openlock._pid_valid_proc(pid_, name_),
+                openlock._pid_valid_ps(pid_, name_),
+            )
+        self.assertTrue(openlock._pid_valid_proc(pid, name))
+        self.assertFalse(openlock._pid_valid_proc(dead, "c"))
+
+    @unittest.skipUnless(openlock.HAS_PROCFS, "no /proc filesystem")
+    def test_starttime(self) -> None:
+        r = FileLock(lock_file)
+        r.acquire(timeout=0)
+        with open(lock_file) as f:
+            s = f.readlines()
+        r.release()
+        self.assertEqual(len(s), 4)
+        pid, starttime, boot_id = int(s[0]), int(s[2]), s[3].strip()
+        self.assertEqual(pid, os.getpid())
+        self.assertEqual(starttime, openlock._process_starttime(pid))
+        # the name is not needed to identify the holder
+        with open(lock_file, "w") as f:
+            f.write(f"{pid}\ndummy\n{starttime}\n{boot_id}\n")
+        self.assertEqual(r.getpid(), pid)
+        # pid reuse
+        with open(lock_file, "w") as f:
+            f.write(f"{pid}\ntest_openlock\n{starttime + 1}\n{boot_id}\n")
+        self.assertFalse(r.locked())
+        # previous boot
+        with open(lock_file, "w") as f:
+            f.write(f"{pid}\ntest_openlock\n{starttime}\nprevious\n")
+        self.assertFalse(r.locked())
+        # invalid start time
+        with open(lock_file, "w") as f:
+            f.write(f"{pid}\ntest_openlock\nyesterday\n{boot_id}\n")
+        r.acquire(timeout=0)
+        self.assertTrue(r.getpid() == os.getpid())
+        r.release()
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_wait_mode_inotify(self) -> None:
+        set_defaults(wait_mode="inotify", retry_period=10.0)
+        r = FileLock(lock_file)
+        p = subprocess.Popen(
+            [sys.executable, "_helper.py", lock_file, "2"], stdout=subprocess.PIPE
+        )
+        time.sleep(1)
+        t = time.time()
+        r.acquire(timeout=5)
+        tt = time.time()
+        r.release()
+        p.communicate()
+        self.assertTrue(tt - t < 2)
+
+    def test_retry_policy(self) -> None:
+        self.assertEqual(FixedRetry(0.5).next_delay(3, 0.5, None), 0.5)
+        self.assertEqual(FixedRetry(0.5).next_delay(3, 0.5, 0.1), 0.1)
+        self.assertEqual(FixedRetry(0.5).next_delay(3, 0.5, -1), 0)
+        e = ExponentialBackoff(base=0.01, cap=1.0)
+        d = DecorrelatedJitter(base=0.01, cap=1.0)
+        previous = 0.0
+        for attempt in range(1, 100):
+            delay = e.next_delay(attempt, previous, None)
+            self.assertTrue(0 <= delay <= min(1.0, 0.01 * 2 ** (attempt - 1)))
+            delay = d.next_delay(attempt, previous, None)
+            self.assertTrue(0.01 <= delay <= min(1.0, max(0.01, 3 * previous)))
+            previous = delay
+        self.assertTrue(d.next_delay(100, 1.0, 0.001) <= 0.001)
+
+        class Incomplete(RetryPolicy):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()  # type: ignore[abstract]
+
+    def test_retry_policy_deadline(self) -> None:
+        r = FileLock(lock_file)
+        r.acquire(timeout=0)
+        s = FileLock(lock_file, retry_policy=FixedRetry(10.0))
+        t = time.time()
+        with self.assertRaises(Timeout):
+            s.acquire(timeout=1)
+        tt = time.time()
+        self.assertTrue(1 <= tt - t < 2)
+
+    def test_async(self) -> None:
+        async def main() -> None:
+            r = AsyncFileLock(lock_file)
+            self.assertFalse(r.locked())
+            async with r:
+                self.assertTrue(r.locked())
+                self.assertTrue(r.getpid() == os.getpid())
+                with self.assertRaises(Timeout):
+                    await AsyncFileLock(lock_file).acquire(timeout=0)
+                with self.assertRaises(Timeout):
+                    FileLock(lock_file).acquire(timeout=0)
+            self.assertFalse(os.path.exists(lock_file))
+
+            # the event loop keeps running while we wait
+            s = FileLock(lock_file)
+            s.acquire(timeout=0)
+            ticks = 0
+
+            async def tick() -> None:
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.ensure_future(tick())
+            with self.assertRaises(Timeout):
+                await r.acquire(timeout=1)
+            s.release()
+            task.cancel()
+            self.assertTrue(ticks > 10)
+            await r.acquire(timeout=0)
+            await r.release()
+
+            # stale lock file
+            with open(lock_file, "w") as f:
+                f.write("1\ntest_openlock.py\n")
+            await r.acquire(timeout=0)
+            await r.release()
+
+        asyncio.run(main())
+
+    def test_reentrant(self) -> None:
+        r = FileLock(lock_file, reentrant=True)
+        with r:
+            with r:
+                r.acquire(timeout=0)
+                self.assertTrue(r.locked())
+                r.release()
+            self.assertTrue(os.path.exists(lock_file))
+            with self.assertRaises(Timeout):
+                FileLock(lock_file).acquire(timeout=0)
+
+            # other threads cannot acquire or release the lock
+            errors: list[type[Exception]] = []
+
+            def other_thread() -> None:
+                try:
+                    r.acquire(timeout=0)
+                except Exception as e:
+                    errors.append(e.__class__)
+                try:
+                    r.release()
+                except Exception as e:
+                    errors.append(e.__class__)
+
+            t = threading.Thread(target=other_thread)
+            t.start()
+            t.join()
+            self.assertEqual(errors, [Timeout, InvalidRelease])
+        self.assertFalse(os.path.exists(lock_file))
+        with self.assertRaises(InvalidRelease):
+            r.release()
+
+    def test_shared(self) -> None:
+        r1 = SharedFileLock(lock_file)
+        r2 = SharedFileLock(lock_file)
+        w = SharedFileLock(lock_file, shared=False)
+        with r1, r2:
+            self.assertTrue(r1.locked() and r2.locked())
+            with self.assertRaises(Timeout):
+                w.acquire(timeout=0.5)
+            self.assertFalse(os.path.exists(lock_file))
+        with w:
+            self.assertTrue(w.locked())
+            with self.assertRaises(Timeout):
+                r1.acquire(timeout=0.5)
+            with self.assertRaises(Timeout):
+                FileLock(lock_file).acquire(timeout=0)
+        with self.assertRaises(InvalidRelease):
+            r1.release()
+
+        # a plain FileLock excludes readers
+        with FileLock(lock_file):
+            with self.assertRaises(Timeout):
+                r1.acquire(timeout=0)
+
+        # tokens of dead readers are ignored
+        os.makedirs(lock_file + ".readers", exist_ok=True)
+        with open(os.path.join(lock_file + ".readers", "1-0.reader"), "w") as f:
+            f.write("1\ntest_openlock.py\n")
+        w.acquire(timeout=0)
+        w.release()
+        self.assertEqual(os.listdir(lock_file + ".readers"), [])
+
+    def test_shared_writer_preference(self) -> None:
+        r1 = SharedFileLock(lock_file)
+        r2 = SharedFileLock(lock_file)
+        w = SharedFileLock(lock_file, shared=False)
+        r1.acquire(timeout=0)
+        t = threading.Thread(target=w.acquire, kwargs={"timeout": 5})
+        t.start()
+        time.sleep(0.5)
+        # a waiting writer keeps new readers out
+        with self.assertRaises(Timeout):
+            r2.acquire(timeout=0)
+        r1.release()
+        t.join()
+        self.assertTrue(w.locked())
+        w.release()
+        r2.acquire(timeout=0)
+        r2.release()
+
+    def test_lock_pool(self) -> None:
+        pool = LockPool(lock_dir, stripes=4, cache_size=2)
+        keys = [f"key{i}" for i in range(100)]
+        for key in keys:
+            with pool.lock(key) as L:
+                self.assertTrue(L.locked())
+                self.assertTrue(pool.stripe(key) == pool.stripe(key.encode()))
+            self.assertTrue(len(pool) <= 2)
+        self.assertEqual(os.listdir(lock_dir), [])
+        self.assertEqual({pool.stripe(key) for key in keys}, {0, 1, 2, 3})
+
+        # keys sharing a lock file
+        key1 = keys[0]
+        key2 = [key for key in keys[1:] if pool.stripe(key) == pool.stripe(key1)][0]
+        key3 = [key for key in keys if pool.stripe(key) != pool.stripe(key1)][0]
+        with pool.lock(key1), pool.lock(key2):
+            self.assertEqual(len(os.listdir(lock_dir)), 1)
+            other_pool = LockPool(lock_dir, stripes=4)
+            with self.assertRaises(Timeout):
+                other_pool.lock(key2).acquire(timeout=0)
+            other_pool.lock(key3).acquire(timeout=0)
+            # held locks are not evicted
+            for key in keys:
+                pool.lock(key)
+            self.assertTrue(pool.lock(key1).locked())
+        self.assertEqual(len(os.listdir(lock_dir)), 1)
+        other_pool.lock(key3).release()
+
+        # locks that are waited for are not evicted either, otherwise a
+        # thread that takes a key again would wait for itself
+        pool = LockPool(lock_dir, stripes=4, cache_size=1, timeout=5)
+        errors: list[Exception] = []
+
+        def worker(i: int) -> None:
+            try:
+                for j in range(50):
+                    key = keys[(i + j) % 3]
+                    with pool.lock(key):
+                        pool.lock(keys[j % len(keys)])
+                        with pool.lock(key):
+                            time.sleep(0.0001)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(lock_dir), [])
+
+    def test_acquire_all(self) -> None:
+        r, s = FileLock(lock_file), FileLock(other_lock_file)
+        acquire_all([s, r, s], timeout=0)
+        self.assertTrue(r.locked() and s.locked())
+        release_all([r, s])
+        self.assertFalse(os.path.exists(lock_file))
+        # different objects on the same lock file
+        t = FileLock(os.path.join(".", lock_file))
+        with self.assertRaises(ValueError):
+            acquire_all([r, t], timeout=0)
+        with self.assertRaises(ValueError):
+            MultiLock([r, s, t])
+        self.assertFalse(os.path.exists(lock_file))
+        self.assertFalse(os.path.exists(other_lock_file))
+
+        # nothing is held after a timeout
+        t = FileLock(other_lock_file)
+        t.acquire(timeout=0)
+        with self.assertRaises(Timeout):
+            acquire_all([r, s], timeout=0.5)
+        self.assertFalse(os.path.exists(lock_file))
+        t.release()
+
+        # opposite orders do not deadlock
+        m = MultiLock([FileLock(other_lock_file), FileLock(lock_file)], timeout=10)
+        self.assertEqual(m.locks[0].lock_file, Path(lock_file))
+
+        def worker(m: MultiLock) -> None:
+            for _ in range(5):
+                with m:
+                    time.sleep(0.01)
+
+        threads = [
+            threading.Thread(target=worker, args=(m,)),
+            threading.Thread(target=worker, args=(MultiLock([s, r], timeout=10),)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(os.path.exists(lock_file))
+        self.assertFalse(os.path.exists(other_lock_file))
+
+    def test_adaptive_race_delay(self) -> None:
+        set_defaults(race_delay=1.0, adaptive_race_delay=True)
+        directory = os.path.dirname(os.path.abspath(lock_file))
+        r = FileLock(lock_file)
+        for _ in range(10):
+            r.acquire(timeout=0)
+            r.release()
+        race_delay = openlock._race_delays.race_delay(directory, 1.0)
+        self.assertTrue(race_delay < 0.5)
+        with open(lock_file, "w") as f:
+            f.write("1\ntest_openlock.py\n")
+        t = time.time()
+        r.acquire(timeout=0)
+        tt = time.time()
+        r.release()
+        self.assertTrue(tt - t < 0.5)
+        # a slow write increases the race delay
+        openlock._race_delays.record(directory, 0.5)
+        self.assertTrue(openlock._race_delays.race_delay(directory, 1.0) >= 2.0)
+        # and ages out after the next 64 samples
+        for _ in range(openlock._RaceDelays.samples):
+            openlock._race_delays.record(directory, 0.001)
+        self.assertAlmostEqual(openlock._race_delays.race_delay(directory, 1.0), 0.01)
+        # other directories are not affected
+        self.assertEqual(openlock._race_delays.race_delay("/nonexistent", 1.0), 1.0)
+
+    def test_create_fallback(self) -> None:
+        use_tmpfile = openlock._use_tmpfile
+        openlock._use_tmpfile = False
+        try:
+            r = FileLock(lock_file)
+            r.acquire(timeout=0)
+            self.assertEqual(r.getpid(), os.getpid())
+            s = FileLock(lock_file)
+            with self.assertRaises(Timeout):
+                s.acquire(timeout=0)
+            r.release()
+        finally:
+            openlock._use_tmpfile = use_tmpfile
+        self.assertEqual([f for f in os.listdir() if f.endswith(".tmp")], [])
+
+    @unittest.skipIf(IS_WINDOWS, "symlinks need privileges")
+    def test_create_fallback_symlink(self) -> None:
+        # a file or symlink planted at the temporary name is not written to
+        temp_name = lock_file + ".tmp"
+        with open(other_lock_file, "w") as f:
+            f.write("planted")
+        os.symlink(other_lock_file, temp_name)
+        openlock._no_tmpfile_dirs.add(".")
+        try:
+            self.assertTrue(
+                openlock._create_file(Path(lock_file), ".", b"data", temp_name)
+            )
+        finally:
+            openlock._no_tmpfile_dirs.discard(".")
+        self.assertFalse(os.path.lexists(temp_name))
+        with open(other_lock_file) as f:
+            self.assertEqual(f.read(), "planted")
+        with open(lock_file) as f:
+            self.assertEqual(f.read(), "data")
+
+    @unittest.skipUnless(openlock._use_tmpfile, "O_TMPFILE is not available")
+    def test_create_tmpfile(self) -> None:
+        # The fallback would fail, since the directory of the temporary
+        # name does not exist.
+        temp_name = os.path.join("nonexistent", "test.tmp")
+        self.assertTrue(openlock._create_file(Path(lock_file), ".", b"data", temp_name))
+        self.assertFalse(
+            openlock._create_file(Path(lock_file), ".", b"other", temp_name)
+        )
+        self.assertNotIn(".", openlock._no_tmpfile_dirs)
+        with open(lock_file) as f:
+            self.assertEqual(f.read(), "data")
+
+    def test_lease(self) -> None:
+        with self.assertRaises(ValueError):
+            FileLock(lock_file, lease=0)
+        r = FileLock(lock_file, lease=0.3)
+        r.acquire(timeout=0)
+        with open(lock_file) as f:
+            lines = f.readlines()
+        self.assertEqual(lines[4].strip(), openlock._hostname())
+        expires = float(lines[5])
+        time.sleep(0.4)
+        with open(lock_file) as f:
+            lines = f.readlines()
+        self.assertTrue(float(lines[5]) > expires)
+        r.release()
+        self.assertFalse(os.path.exists(lock_file))
+
+        # a live lease of a process with a dead PID on another host
+        dead = dead_pid()
+        with open(lock_file, "w") as f:
+            f.write(f"{dead}\ntest_openlock.py\n\n\nother\n{time.time() + 0.5}\n")
+        s = FileLock(lock_file)
+        with self.assertRaises(Timeout):
+            s.acquire(timeout=0)
+        self.assertTrue(s.locked())
+        # the lease expires
+        time.sleep(0.5)
+        s.acquire(timeout=0)
+        s.release()
+
+        # an expired lease of a live process is stale
+        with open(lock_file, "w") as f:
+            f.write(f"{os.getpid()}\ntest_openlock.py\n\n\nother\n{time.time()}\n")
+        self.assertFalse(s.locked())
+
+    def test_lease_lost(self) -> None:
+        r = FileLock(lock_file, lease=0.3)
+        r.acquire(timeout=0)
+        # another host takes over
+        hostname = openlock._hostname
+        openlock._hostname = lambda: "other"
+        try:
+            openlock._write_file(
+                r.lock_file,
+                openlock._lock_file_data(
+                    os.getpid(), "test_openlock.py", None, time.time() + 10
+                ),
+            )
+        finally:
+            openlock._hostname = hostname
+        time.sleep(0.2)
+        self.assertTrue(r.lease_lost)
+        r.release()
+        # the lock file of the other host is left alone
+        s = FileLock(lock_file)
+        self.assertTrue(s.locked())
+        os.remove(lock_file)
+
+    @unittest.skipIf(IS_WINDOWS, "Unix domain sockets are not available")
+    def test_server(self) -> None:
+        socket_path = os.path.abspath("test.sock")
+        # the server is not running
+        set_defaults(server=socket_path)
+        r = FileLock(lock_file)
+        r.acquire(timeout=0)
+        r.release()
+
+        server = LockServer(socket_path)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            r = FileLock(lock_file)
+            s = FileLock(lock_file)
+            r.acquire(timeout=0)
+            self.assertTrue(os.path.exists(lock_file))
+            with self.assertRaises(Timeout):
+                s.acquire(timeout=0)
+            with self.assertRaises(Timeout):
+                s.acquire(timeout=0.1)
+            # a waiter is woken up when the lock is released
+            acquired = threading.Event()
+
+            def waiter() -> None:
+                s.acquire()
+                acquired.set()
+
+            thread_ = threading.Thread(target=waiter)
+            thread_.start()
+            time.sleep(0.1)
+            self.assertFalse(acquired.is_set())
+            t = time.time()
+            r.release()
+            thread_.join()
+            self.assertTrue(time.time() - t < 0.1)
+            s.release()
+            # the lock of a client that dies is released
+            p = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import os, openlock; "
+                    f"openlock.set_defaults(server={socket_path!r}); "
+                    f"openlock.FileLock({lock_file!r}).acquire(); "
+                    "os._exit(0)",
+                ]
+            )
+            self.assertEqual(p.returncode, 0)
+            r.acquire(timeout=1)
+            r.release()
+        finally:
+            server.stop()
+            thread.join()
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_fair(self) -> None:
+        tickets = lock_file + ".tickets"
+
+        def wait_for_ticket(pid: int) -> None:
+            # Counting the files in the tickets directory is not enough, as
+            # they may not all be tickets of the waiters we started.
+            while True:
+                for name in os.listdir(tickets):
+                    try:
+                        with open(os.path.join(tickets, name)) as f:
+                            if f.readline().strip() == str(pid):
+                                return
+                    except FileNotFoundError:
+                        pass
+                time.sleep(0.01)
+
+        r = FileLock(lock_file, fair=True)
+        r.acquire(timeout=0)
+        code = (
+            "import sys, openlock; "
+            "openlock.set_defaults(retry_period=0.01); "
+            f"r = openlock.FileLock({lock_file!r}, fair=True); "
+            "r.acquire(); "
+            f"f = open({other_lock_file!r}, 'a'); "
+            "f.write(sys.argv[1] + ' '); "
+            "f.close(); "
+            "r.release()"
+        )
+        processes = []
+        for i in range(5):
+            processes.append(subprocess.Popen([sys.executable, "-c", code, str(i)]))
+            wait_for_ticket(processes[-1].pid)
+        r.release()
+        for p in processes:
+            p.wait()
+        with open(other_lock_file) as f:
+            self.assertEqual(f.read().split(), [str(i) for i in range(5)])
+        self.assertEqual(os.listdir(tickets), [])
+
+        # threads in the same process are served in order as well
+        r.acquire(timeout=0)
+        order: list[int] = []
+
+        def waiter(i: int) -> None:
+            s = FileLock(lock_file, fair=True)
+            s.acquire()
+            order.append(i)
+            time.sleep(0.05)
+            s.release()
+
+        threads = []
+        for i in range(5):
+            thread = threading.Thread(target=waiter, args=(i,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+        self.assertEqual(len(os.listdir(tickets)), 5)
+        r.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, list(range(5)))
+        self.assertEqual(os.listdir(tickets), [])
+
+        # a thread does not overtake the ticket of another process
+        os.remove(other_lock_file)
+        r.acquire(timeout=0)
+        p = subprocess.Popen([sys.executable, "-c", code, "process"])
+        wait_for_ticket(p.pid)
+
+        def thread_waiter() -> None:
+            s = FileLock(lock_file, fair=True)
+            s.acquire()
+            with open(other_lock_file, "a") as f:
+                f.write("thread ")
+            s.release()
+
+        thread = threading.Thread(target=thread_waiter)
+        thread.start()
+        wait_for_ticket(os.getpid())
+        r.release()
+        thread.join()
+        p.wait()
+        with open(other_lock_file) as f:
+            self.assertEqual(f.read().split(), ["process", "thread"])
+
+        # the ticket of a dead process is skipped
+        dead = dead_pid()
+        with open(os.path.join(tickets, "000000000001.ticket"), "w") as f:
+            f.write(f"{dead}\ntest_openlock.py\n")
+        r.acquire(timeout=0)
+        r.release()
+        self.assertEqual(os.listdir(tickets), [])
+
+        # a plain lock excludes a fair one
+        s = FileLock(lock_file)
+        s.acquire(timeout=0)
+        with self.assertRaises(Timeout):
+            r.acquire(timeout=0.1)
+        s.release()
+        self.assertEqual(os.listdir(tickets), [])
+
+    def test_inspect(self) -> None:
+        os.makedirs(lock_dir)
+        r = FileLock(os.path.join(lock_dir, "a.lock"))
+        r.acquire(timeout=0)
+        dead = dead_pid()
+        contents = {
+            "b.lock": f"{dead}\ntest_openlock.py\n",
+            "c.lock": "garbage\n",
+            "d.lock": f"{os.getpid()}\n{openlock._own_name()}\n",
+            "e.txt": f"{os.getpid()}\n{openlock._own_name()}\n",
+        }
+        for name, content in contents.items():
+            with open(os.path.join(lock_dir, name), "w") as f:
+                f.write(content)
+        expected = [
+            ("a.lock", "locked", os.getpid()),
+            ("b.lock", "stale", dead),
+            ("c.lock", "invalid", None),
+            ("d.lock", "locked", os.getpid()),
+        ]
+        has_procfs = openlock.HAS_PROCFS
+        try:
+            # with and without /proc
+            for has_procfs_ in (has_procfs, False):
+                openlock.HAS_PROCFS = has_procfs_
+                infos = inspect(lock_dir)
+                self.assertEqual(
+                    [(i.path.name, i.state, i.pid) for i in infos], expected
+                )
+        finally:
+            openlock.HAS_PROCFS = has_procfs
+        r.release()
+        infos = inspect(lock_dir, "*.txt")
+        self.assertEqual([(i.path.name, i.state) for i in infos], [("e.txt", "locked")])
+
+    def test_reap(self) -> None:
+        os.makedirs(lock_dir)
+        r = FileLock(os.path.join(lock_dir, "a.lock"))
+        r.acquire(timeout=0)
+        dead = dead_pid()
+        stale = {
+            "b.lock": f"{dead}\ntest_openlock.py\n",
+            "c.lock": "garbage\n",
+            "d.lock": f"{dead}\ntest_openlock.py\n",
+        }
+        for name, content in stale.items():
+            with open(os.path.join(lock_dir, name), "w") as f:
+                f.write(content)
+        t = time.time()
+        reaped = reap(lock_dir)
+        # The stale files are taken over concurrently. One after the other
+        # they would take at least one race delay each. On Windows every
+        # liveness check starts powershell, so the time is not meaningful.
+        if not IS_WINDOWS:
+            race_delay = get_defaults()["race_delay"]
+            self.assertTrue(time.time() - t < len(stale) * race_delay)
+        self.assertEqual([path.name for path in reaped], sorted(stale))
+        self.assertEqual(os.listdir(lock_dir), ["a.lock"])
+        self.assertEqual(r.getpid(), os.getpid())
+        self.assertEqual(reap(lock_dir), [])
+        with self.assertRaises(ValueError):
+            Reaper(lock_dir, interval=0)
+        reaper = Reaper(lock_dir, interval=0.1)
+        reaper.start()
+        stale_file = os.path.join(lock_dir, "b.lock")
+        with open(stale_file, "w") as f:
+            f.write(stale["b.lock"])
+        t = time.time()
+        while os.path.exists(stale_file):
+            self.assertTrue(time.time() - t < 5)
+            time.sleep(0.05)
+        reaper.stop()
+        self.assertTrue(r.locked())
+        r.release()
+
+    def test_semaphore(self) -> None:
+        with self.assertRaises(ValueError):
+            FileSemaphore(lock_dir, slots=0)
+        r = FileSemaphore(lock_dir, slots=3)
+        s = FileSemaphore(lock_dir, slots=3)
+        with self.assertRaises(InvalidRelease):
+            r.release()
+        self.assertIsNone(r.slot)
+        slots = set()
+        for _ in range(2):
+            r.acquire(timeout=0)
+            slots.add(r.slot)
+        with s:
+            slot = s.slot
+            slots.add(slot)
+            self.assertEqual(slots, {0, 1, 2})
+            with self.assertRaises(Timeout):
+                r.acquire(timeout=0)
+            t = time.time()
+            with self.assertRaises(Timeout):
+                r.acquire(timeout=0.5)
+            self.assertTrue(time.time() - t >= 0.5)
+        r.acquire(timeout=0)
+        self.assertEqual(r.slot, slot)
+        for _ in range(3):
+            r.release()
+        self.assertFalse(r.locked())
+        # the slot of a dead holder is taken over
+        dead = dead_pid()
+        with open(os.path.join(lock_dir, "slot-1.lock"), "w") as f:
+            f.write(f"{dead}\ntest_openlock.py\n")
+        u = FileSemaphore(lock_dir, slots=2)
+        u.acquire(timeout=0)
+        u.acquire(timeout=0)
+        with self.assertRaises(Timeout):
+            u.acquire(timeout=0)
+        u.release()
+        u.release()
+        self.assertEqual(os.listdir(lock_dir), [])
+
+    def test_in_process(self) -> None:
+        # no polling
+        set_defaults(retry_period=10.0)
+        r = FileLock(lock_file)
+        s = FileLock(os.path.join(".", lock_file))
+        r.acquire(timeout=0)
+        inode = os.stat(lock_file).st_ino
+        with self.assertRaises(Timeout):
+            s.acquire(timeout=0)
+        acquired = threading.Event()
+
+        def waiter() -> None:
+            s.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.1)
+        t = time.time()
+        r.release()
+        thread.join()
+        self.assertTrue(time.time() - t < 0.1)
+        # the lock file was handed over
+        self.assertEqual(os.stat(lock_file).st_ino, inode)
+        self.assertEqual(s.getpid(), os.getpid())
+        with self.assertRaises(InvalidRelease):
+            r.release()
+        s.release()
+        self.assertFalse(os.path.exists(lock_file))
+
+    def test_transfer(self) -> None:
+        r = FileLock(lock_file)
+        with self.assertRaises(InvalidTransfer):
+            r.transfer(os.getpid())
+        with self.assertRaises(InvalidTransfer):
+            r.adopt()
+        script = (
+            "import sys, openlock\n"
+            f"r = openlock.FileLock({lock_file!r})\n"
+            "sys.stdin.readline()\n"
+            "r.adopt()\n"
+            "print('adopted', flush=True)\n"
+            "sys.stdin.readline()\n"
+        )
+        p = subprocess.Popen(
+            [sys.executable, "-c", script],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        assert p.stdin is not None and p.stdout is not None
+        r.acquire(timeout=0)
+        inode = os.stat(lock_file).st_ino
+        r.transfer(p.pid, name="-c")
+        with self.assertRaises(InvalidRelease):
+            r.release()
+        p.stdin.write("\n")
+        p.stdin.flush()
+        self.assertEqual(p.stdout.readline().strip(), "adopted")
+        # the lock file was replaced, not removed
+        self.assertNotEqual(os.stat(lock_file).st_ino, inode)
+        self.assertEqual(r.getpid(), p.pid)
+        with self.assertRaises(Timeout):
+            r.acquire(timeout=0)
+        # the new holder removes the lock file at exit
+        p.stdin.write("\n")
+        p.stdin.flush()
+        p.wait()
+        self.assertFalse(os.path.exists(lock_file))
+        r.acquire(timeout=0)
+        r.release()
+
+        # Lock files with our PID written on another host, on another boot
+        # or by an earlier process with the same PID are not ours.
+        pid = os.getpid()
+        starttime = openlock._get_own_starttime()
+        starttime_ = "" if starttime is None else str(starttime)
+        boot_id = openlock._boot_id
+        others = [f"{pid}\n-c\n{starttime_}\n{boot_id}\nother\n{time.time() + 60}\n"]
+        if boot_id:
+            others.append(f"{pid}\n-c\n{starttime_}\nother\n")
+        if starttime is not None:
+            others.append(f"{pid}\n-c\n{starttime + 1}\n{boot_id}\n")
+        for other in others:
+            with open(lock_file, "w") as f:
+                f.write(other)
+            with self.assertRaises(InvalidTransfer):
+                r.adopt()
+        with open(lock_file, "w") as f:
+            f.write(f"{pid}\n-c\n{starttime_}\n{boot_id}\n")
+        r.adopt()
+        r.release()
+        self.assertFalse(os.path.exists(lock_file))
+
+    @unittest.skipIf(IS_WINDOWS, "fork is not available")
+    def test_transfer_fork(self) -> None:
+        ctx = multiprocessing.get_context("fork")
+        r = FileLock(lock_file)
+        r.acquire(timeout=0)
+        transferred, adopted, done = ctx.Event(), ctx.Event(), ctx.Event()
+
+        def child() -> None:
+            transferred.wait()
+            s = FileLock(lock_file)
+            s.adopt()
+            adopted.set()
+            done.wait()
+            s.release()
+
+        p = ctx.Process(target=child)
+        p.start()
+        assert p.pid is not None
+        r.transfer(p.pid)
+        transferred.set()
+        self.assertTrue(adopted.wait(10))
+        self.assertEqual(r.getpid(), p.pid)
+        with self.assertRaises(Timeout):
+            r.acquire(timeout=0)
+        done.set()
+        p.join()
+        self.assertEqual(p.exitcode, 0)
+        self.assertFalse(os.path.exists(lock_file))
+
+    def test_cache_ttl(self) -> None:
+        with self.assertRaises(ValueError):
+            FileLock(lock_file, cache_ttl=-1)
+        r = FileLock(lock_file, cache_ttl=60)
+        self.assertIsNone(r.getpid())
+        p = foreign_holder(lock_file)
+        self.assertEqual(r.getpid(), p.pid)
+        p.kill()
+        p.wait()
+        # the cached state is used while the lock file is unchanged
+        self.assertTrue(r.locked())
+        self.assertEqual(r.getpid(), p.pid)
+        self.assertIsNone(r.getpid(fresh=True))
+        self.assertFalse(r.locked(fresh=True))
+        with open(lock_file, "w") as f:
+            f.write(f"{p.pid}\ntime.sleep\n\n\n")
+        self.assertFalse(r.locked())
+        r.acquire(timeout=0)
+        self.assertEqual(r.getpid(), os.getpid())
+        r.release()
+        self.assertIsNone(r.getpid())
+
+    def test_deadlock(self) -> None:
+        r = FileLock(lock_file, detect_deadlock=True)
+        s = FileLock(other_lock_file, detect_deadlock=True)
+        r.acquire(timeout=0)
+        script = (
+            "import openlock\n"
+            f"s = openlock.FileLock({other_lock_file!r})\n"
+            "s.acquire(timeout=0)\n"
+            "print('ready', flush=True)\n"
+            f"r = openlock.FileLock({lock_file!r}, detect_deadlock=True)\n"
+            "try:\n"
+            "    r.acquire(timeout=10)\n"
+            "    print('acquired', flush=True)\n"
+            "    r.release()\n"
+            "except openlock.Deadlock:\n"
+            "    print('deadlock', flush=True)\n"
+            "s.release()\n"
+        )
+        p = subprocess.Popen(
+            [sys.executable, "-c", script], stdout=subprocess.PIPE, text=True
+        )
+        assert p.stdout is not None
+        self.assertEqual(p.stdout.readline().strip(), "ready")
+        t = time.time()
+        try:
+            s.acquire(timeout=10)
+        except Deadlock as e:
+            # we have the highest PID
+            self.assertTrue(os.getpid() > p.pid)
+            self.assertIn(f"PID {p.pid} waits for '{lock_file}'", str(e))
+            r.release()
+            self.assertEqual(p.stdout.readline().strip(), "acquired")
+        else:
+            self.assertTrue(p.pid > os.getpid())
+            self.assertEqual(p.stdout.readline().strip(), "deadlock")
+            s.release()
+            r.release()
+        self.assertTrue(time.time() - t < 5)
+        p.wait()
+        self.assertEqual([f for f in os.listdir(".") if f.endswith(".wait")], [])
+
+    def test_single_flight(self) -> None:
+        calls = os.path.join(lock_dir, "calls")
+        script = (
+            "import time, openlock\n"
+            f"@openlock.single_flight({lock_dir!r})\n"
+            "def square(x):\n"
+            f"    with open({calls!r}, 'a') as f:\n"
+            "        f.write('x')\n"
+            "    time.sleep(0.5)\n"
+            "    return x * x\n"
+            "print(square(7), flush=True)\n"
+        )
+        os.makedirs(lock_dir)
+        ps = [
+            subprocess.Popen(
+                [sys.executable, "-c", script], stdout=subprocess.PIPE, text=True
+            )
+            for _ in range(4)
+        ]
+        outs = [p.communicate()[0].strip() for p in ps]
+        self.assertEqual(outs, ["49"] * 4)
+        # computed once
+        with open(calls) as f:
+            self.assertEqual(f.read(), "x")
+        self.assertEqual([f for f in os.listdir(lock_dir) if f.endswith(".lock")], [])
+
+        computed = []
+
+        @single_flight(lock_dir)
+        def add(x: int, y: int = 0) -> int:
+            computed.append((x, y))
+            if x < 0:
+                raise ValueError("negative")
+            return x + y
+
+        self.assertEqual(add(1, y=2), 3)
+        self.assertEqual(add(1, y=2), 3)
+        self.assertEqual(computed, [(1, 2)])
+        self.assertEqual(add(1), 1)
+        self.assertEqual(computed, [(1, 2), (1, 0)])
+        # exceptions are not cached
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                add(-1)
+        self.assertEqual(len(computed), 4)
+
+        @single_flight(lock_dir, max_size=0)
+        def double(x: int) -> int:
+            computed.append((x, x))
+            return 2 * x
+
+        # evicted at once
+        self.assertEqual(double(1), 2)
+        self.assertEqual(double(1), 2)
+        self.assertEqual(len(computed), 6)
+        self.assertEqual([f for f in os.listdir(lock_dir) if f.endswith(".pickle")], [])
+
+        @single_flight(lock_dir, max_age=0.5)
+        def now() -> float:
+            return time.time()
+
+        t = now()
+        self.assertEqual(now(), t)
+        time.sleep(0.6)
+        self.assertNotEqual(now(), t)
+        with self.assertRaises(ValueError):
+            single_flight(lock_dir, max_age=0)
+
+    @unittest.skipIf(IS_WINDOWS, "fork is not available")
+    def test_in_process_fork(self) -> None:
+        ctx = multiprocessing.get_context("fork")
+        r = FileLock(lock_file)
+        r.acquire(timeout=0)
+        queue = ctx.Queue()
+
+        def child() -> None:
+            # the registry of the parent is not inherited
+            s = FileLock(lock_file)
+            try:
+                s.acquire(timeout=5)
+            except Timeout:
+                queue.put(False)
+                return
+            queue.put(s.getpid() == os.getpid())
+            s.release()
+
+        p = ctx.Process(target=child)
+        p.start()
+        time.sleep(0.5)
+        r.release()
+        self.assertTrue(queue.get(timeout=10))
+        p.join()
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_inotify_removals(self) -> None:
+        inotify = openlock._get_inotify()
+        if inotify is None:
+            self.skipTest("inotify is not available")
+        set_defaults(wait_mode="inotify")
+        p = foreign_holder(lock_file)
+        stop = threading.Event()
+
+        def churn() -> None:
+            # temporary files in the watched directory
+            while not stop.is_set():
+                openlock._write_file(Path(other_lock_file), b"")
+                os.remove(other_lock_file)
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        r = FileLock(lock_file)
+        try:
+            with self.assertRaises(Timeout):
+                r.acquire(timeout=1)
+        finally:
+            stop.set()
+            thread.join()
+            p.kill()
+            p.wait()
+        # only watched files are counted, and nothing is watched anymore
+        self.assertEqual(inotify._Inotify__removals, {})  # type: ignore
+
+    def test_metrics(self) -> None:
+        events: list[str] = []
+
+        def hook(event: str, lock: FileLock, value: float) -> None:
+            events.append(event)
+
+        r = FileLock(lock_file)
+        r.acquire()
+        r.release()
+        self.assertEqual(r.stats.acquisitions, 0)
+        enable_metrics(hook)
+        try:
+            total = get_metrics()
+            r.acquire()
+            time.sleep(0.1)
+            r.release()
+            self.assertEqual(r.stats.acquisitions, 1)
+            self.assertEqual(r.stats.releases, 1)
+            self.assertTrue(r.stats.hold_time >= 0.1)
+            self.assertEqual(events, ["acquire", "release"])
+            with open(lock_file, "w") as f:
+                f.write("1\ntest_openlock.py\n")
+            r.acquire(timeout=0)
+            r.release()
+            self.assertEqual(r.stats.stale_takeovers, 1)
+            self.assertTrue(r.stats.liveness_checks >= 1)
+            r.acquire()
+            s = FileLock(lock_file)
+            with self.assertRaises(Timeout):
+                s.acquire(timeout=0.5)
+            r.release()
+            self.assertEqual(s.stats.timeouts, 1)
+            self.assertTrue(s.stats.wait_time >= 0.5)
+            # a lock held by another process is retried
+            p = foreign_holder(lock_file)
+            with self.assertRaises(Timeout):
+                s.acquire(timeout=0.1)
+            p.kill()
+            p.wait()
+            os.remove(lock_file)
+            self.assertEqual(s.stats.timeouts, 2)
+            self.assertTrue(s.stats.retries >= 1)
+            self.assertEqual(get_metrics().acquisitions - total.acquisitions, 3)
+            r.stats.reset()
+            self.assertEqual(r.stats.acquisitions, 0)
+        finally:
+            disable_metrics()
+        r.acquire()
+        r.release()
+        self.assertEqual(r.stats.acquisitions, 0)
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)